@@ -3,7 +3,18 @@
 
 """The SageMathCell installer fabric file"""
 
-from fabric.api import local
+from os import chmod, environ, pathsep
+from os.path import join
+from shutil import rmtree
+from subprocess import check_call
+from sys import executable
+from tempfile import mkdtemp
+from time import time
+
+from fabric.api import abort, local
+
+# Maximum startup time of the sagecell command (in seconds)
+startup_budget = 0.15
 
 def git():
     """Setup Git"""
@@ -18,6 +29,35 @@ def live():
     local("python setup.py register -r pypi")
     local("python setup.py sdist --format=zip,gztar upload -r pypi")
 
+def startup():
+    """Check startup time of "sagecell -v", "--help" and "open" commands"""
+
+    # "sagecell open" runs a stub instead of a browser
+    stub_path = mkdtemp()
+    with open(join(stub_path, "xdg-open"), 'w') as f:
+        f.write("#! /bin/sh\n")
+    chmod(join(stub_path, "xdg-open"), 0o755)
+    env = dict(environ, PATH=stub_path + pathsep + environ["PATH"])
+    command = [executable, "-c", "from sagecell.sagecell import main; main()"]
+    slow = []
+    try:
+        with open("/dev/null", 'w') as devnull:
+            for args in (["-v"], ["--help"], ["open"]):
+                timings = []
+                for i in range(5):
+                    start_time = time()
+                    check_call(command + args, env=env, stdout=devnull,
+                               stderr=devnull)
+                    timings.append(time() - start_time)
+                print("sagecell %s: %.3f s" % (" ".join(args), min(timings)))
+                if min(timings) > startup_budget:
+                    slow.append(" ".join(args))
+    finally:
+        rmtree(stub_path)
+    if slow:
+        abort("Startup time budget (%s s) exceeded: %s" %
+              (startup_budget, ", ".join(slow)))
+
 def test():
     """Upload package to PyPI Test"""
 
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Fingerprinted and precompressed static assets of the SageMathCell"""
+
+from gzip import GzipFile
+from hashlib import sha256
+from io import BytesIO
+from json import dump, load
+from multiprocessing.pool import ThreadPool
+from os import remove, rename, walk
+from os.path import exists, getsize, join, relpath, splitext
+from re import compile as re_compile
+from subprocess import call, check_call
+
+manifest_name = "manifest.json"
+extensions = (".css", ".html", ".js", ".json", ".svg")
+fingerprint_pattern = re_compile(r"\.[0-9a-f]{8}$")
+
+def find_assets(static_path):
+    """Return relative paths of text assets, not fingerprinted copies"""
+
+    paths = []
+    for dir_path, dir_names, file_names in walk(static_path):
+        for name in file_names:
+            stem, extension = splitext(name)
+            if (extension in extensions and name != manifest_name and
+                    not fingerprint_pattern.search(stem)):
+                paths.append(relpath(join(dir_path, name), static_path))
+    return sorted(paths)
+
+def write_atomic(path, data):
+    """Write the file through a temporary file"""
+
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    rename(temp_path, path)
+
+def gzip_data(data):
+    """Return gzip data at maximum compression, without a timestamp"""
+
+    buffer = BytesIO()
+    # mtime=0 keeps the output the same for the same input
+    f = GzipFile(filename="", mode='wb', compresslevel=9, fileobj=buffer,
+                 mtime=0)
+    f.write(data)
+    f.close()
+    return buffer.getvalue()
+
+def brotli_available():
+    """Check for the brotli module or the brotli command line tool"""
+
+    try:
+        import brotli
+    except ImportError:
+        return call("command -v brotli > /dev/null", shell=True) == 0
+    return True
+
+def brotli_file(path):
+    """Write a .br copy at maximum compression"""
+
+    try:
+        from brotli import compress
+    except ImportError:
+        # The brotli command line tool
+        check_call(["brotli", "--force", "--best", "--output=%s.br" % path,
+                    path])
+        return
+    with open(path, 'rb') as f:
+        data = f.read()
+    write_atomic(path + ".br", compress(data, quality=11))
+
+def optimize_asset(static_path, rel_path, brotli=False):
+    """Write a fingerprinted copy and compressed copies of the asset
+
+    Return the manifest entry.
+    """
+
+    path = join(static_path, rel_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = sha256(data).hexdigest()
+    stem, extension = splitext(rel_path)
+    fingerprinted = "%s.%s%s" % (stem, digest[:8], extension)
+    fingerprinted_path = join(static_path, fingerprinted)
+    write_atomic(fingerprinted_path, data)
+    gzipped = gzip_data(data)
+    entry = {"path": fingerprinted, "sha256": digest, "size": len(data)}
+    # Compressed copies are sent only if they are smaller
+    if len(gzipped) < len(data):
+        for target in (path, fingerprinted_path):
+            write_atomic(target + ".gz", gzipped)
+        entry["gzip_size"] = len(gzipped)
+    elif exists(path + ".gz"):
+        remove(path + ".gz")
+    if brotli:
+        for target in (path, fingerprinted_path):
+            brotli_file(target)
+        entry["brotli_size"] = getsize(path + ".br")
+    elif exists(path + ".br"):
+        remove(path + ".br")
+    return entry
+
+def optimize_assets(static_path, brotli=False, jobs=1):
+    """Fingerprint and precompress all assets, write the manifest
+
+    The manifest maps asset paths to fingerprinted paths, which never
+    change and can be cached forever. Fingerprinted copies of the
+    previous manifest are removed. Return the manifest.
+    """
+
+    manifest_path = join(static_path, manifest_name)
+    old_manifest = {}
+    if exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            old_manifest = load(f)
+    paths = find_assets(static_path)
+    pool = ThreadPool(jobs)
+    try:
+        entries = pool.map(lambda rel_path: optimize_asset(static_path,
+                                                           rel_path, brotli),
+                           paths)
+    finally:
+        pool.close()
+    manifest = dict(zip(paths, entries))
+    current = set(entry["path"] for entry in entries)
+    for entry in old_manifest.values():
+        if entry["path"] not in current:
+            for suffix in ("", ".gz", ".br"):
+                if exists(join(static_path, entry["path"] + suffix)):
+                    remove(join(static_path, entry["path"] + suffix))
+    with open(manifest_path + ".tmp", 'w') as f:
+        dump(manifest, f, indent=2, separators=(',', ': '), sort_keys=True)
+    rename(manifest_path + ".tmp", manifest_path)
+    return manifest
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""Sticky least-connections reverse proxy for SageMathCell workers"""
+
+from collections import OrderedDict
+from re import compile as re_compile, IGNORECASE
+from socket import create_connection, error as socket_error, socket
+from socket import AF_INET, SHUT_WR, SO_REUSEADDR, SOCK_STREAM, SOL_SOCKET
+from threading import Lock, Thread
+from time import sleep, time
+
+# Kernel ids and SockJS sessions in URLs, kernel ids in responses
+uuid_pattern = re_compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-"
+                          r"[0-9a-f]{4}-[0-9a-f]{12}", IGNORECASE)
+sockjs_pattern = re_compile(r"/sockjs/[^/ ]+/([^/ ]+)/")
+cookie_name = "sagecell_worker"
+cookie_pattern = re_compile(r"(?:^|[;\s])%s=(\d+)" % cookie_name)
+max_head_size = 65536
+max_sessions = 100000
+
+class Backend(object):
+    """SageMathCell worker (web_server.py) behind the balancer"""
+
+    def __init__(self, index, host, port):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.failures = 0
+        self.healthy = True
+
+    def __repr__(self):
+        return "Backend(%s:%s)" % (self.host, self.port)
+
+def read_head(sock, data=b""):
+    """Read from the socket up to the end of HTTP head
+
+    Return the head and the rest of the read data. The head is empty if
+    the connection was closed or the head is too long.
+    """
+
+    while b"\r\n\r\n" not in data:
+        if len(data) > max_head_size:
+            return b"", data
+        chunk = sock.recv(8192)
+        if not chunk:
+            return b"", data
+        data += chunk
+    end = data.index(b"\r\n\r\n") + 4
+    return data[:end], data[end:]
+
+def header(head, name):
+    """Return a value of the HTTP header or None"""
+
+    for line in head.split(b"\r\n")[1:]:
+        key, colon, value = line.partition(b":")
+        if colon and key.strip().lower() == name.lower():
+            return value.strip()
+    return None
+
+def set_header(head, name, value):
+    """Return the HTTP head with replaced (or added) header"""
+
+    lines = [line for line in head.split(b"\r\n")[:-2]
+             if line.partition(b":")[0].strip().lower() != name.lower()]
+    lines.append(name + b": " + value)
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+class Balancer(object):
+    """Spread new sessions by least connections and keep them sticky
+
+    A request is routed by (in order): the worker cookie, a kernel id or
+    a SockJS session in the URL, a recent request from the same client
+    address (within "affinity_ttl" seconds) and the least number of open
+    connections. Kernel ids found in responses are bound to the worker,
+    which created them. Every request is forwarded with "Connection:
+    close", so that keep-alive does not bypass the routing. Websocket
+    connections are forwarded as is.
+    """
+
+    def __init__(self, backends, affinity_ttl=30.0, health_interval=2.0,
+                 health_failures=3):
+        self.backends = backends
+        self.affinity_ttl = affinity_ttl
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.lock = Lock()
+        self.sessions = OrderedDict() # Session key -> backend
+        self.clients = OrderedDict() # Client address -> (backend, time)
+        self.turn = 0 # Round robin between equally loaded backends
+        self.running = False
+
+    def bind(self, key, backend):
+        """Bind the session key to the backend"""
+
+        with self.lock:
+            self.sessions.pop(key, None)
+            self.sessions[key] = backend
+            while len(self.sessions) > max_sessions:
+                self.sessions.popitem(last=False)
+
+    def choose(self, head, address):
+        """Return a backend for the request and a flag of a new session"""
+
+        with self.lock:
+            healthy = [backend for backend in self.backends
+                       if backend.healthy]
+            if not healthy:
+                return None, False
+            match = cookie_pattern.search(
+                (header(head, b"Cookie") or b"").decode("latin-1"))
+            if match and int(match.group(1)) < len(self.backends):
+                backend = self.backends[int(match.group(1))]
+                if backend.healthy:
+                    return backend, False
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            keys = uuid_pattern.findall(request_line)
+            keys += sockjs_pattern.findall(request_line)
+            for key in keys:
+                backend = self.sessions.get(key.lower())
+                if backend is not None and backend.healthy:
+                    return backend, False
+            backend, timestamp = self.clients.get(address, (None, 0))
+            if (backend is None or not backend.healthy or
+                    time() - timestamp > self.affinity_ttl):
+                self.turn = (self.turn + 1) % len(healthy)
+                healthy = healthy[self.turn:] + healthy[:self.turn]
+                backend = min(healthy, key=lambda b: b.connections)
+            # Clients are kept in the order of last requests
+            now = time()
+            self.clients.pop(address, None)
+            self.clients[address] = (backend, now)
+            while (len(self.clients) > max_sessions or
+                   now - next(iter(self.clients.values()))[1] >
+                   self.affinity_ttl):
+                self.clients.popitem(last=False)
+        for key in keys:
+            self.bind(key.lower(), backend)
+        return backend, True
+
+    def check_health(self):
+        """Check backends by TCP connections, drop failed ones"""
+
+        while self.running:
+            for backend in self.backends:
+                try:
+                    create_connection((backend.host, backend.port),
+                                      self.health_interval).close()
+                except socket_error:
+                    with self.lock:
+                        backend.failures += 1
+                        if backend.failures >= self.health_failures:
+                            backend.healthy = False
+                else:
+                    with self.lock:
+                        backend.failures = 0
+                        backend.healthy = True
+            sleep(self.health_interval)
+
+    def handle(self, client, address):
+        """Forward the client connection to a backend"""
+
+        upstream = None
+        backend = None
+        try:
+            head, rest = read_head(client)
+            if not head:
+                return
+            if header(head, b"Upgrade") is None:
+                head = set_header(head, b"Connection", b"close")
+            # Try the next backend, if the chosen one is down
+            while upstream is None:
+                backend, new_session = self.choose(head, address[0])
+                if backend is None:
+                    client.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                                   b"Content-Length: 0\r\n"
+                                   b"Connection: close\r\n\r\n")
+                    return
+                try:
+                    upstream = create_connection((backend.host,
+                                                  backend.port))
+                except socket_error:
+                    with self.lock:
+                        backend.failures += 1
+                        backend.healthy = False
+            with self.lock:
+                backend.connections += 1
+            upstream.sendall(head + rest)
+            pipe = Thread(target=self.pipe, args=(client, upstream))
+            pipe.daemon = True
+            pipe.start()
+            # The client side pipe stops, when both sockets are closed
+            self.respond(upstream, client, backend, new_session)
+        except socket_error:
+            pass
+        finally:
+            if backend is not None and upstream is not None:
+                with self.lock:
+                    backend.connections -= 1
+            for sock in (client, upstream):
+                if sock is not None:
+                    sock.close()
+
+    def pipe(self, source, target):
+        """Copy data from the source to the target socket"""
+
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                target.sendall(data)
+            target.shutdown(SHUT_WR)
+        except socket_error:
+            pass
+
+    def respond(self, upstream, client, backend, new_session):
+        """Forward the response, learn kernel ids, set the worker cookie"""
+
+        head, rest = read_head(upstream)
+        if head:
+            # Kernel ids of the /kernel response are in the body, which
+            # may come after the head
+            length = header(head, b"Content-Length")
+            if (length is not None and length.isdigit() and
+                    int(length) <= max_head_size):
+                while len(rest) < int(length):
+                    chunk = upstream.recv(8192)
+                    if not chunk:
+                        break
+                    rest += chunk
+            for key in uuid_pattern.findall((head + rest).decode("latin-1")):
+                self.bind(key.lower(), backend)
+            if new_session:
+                cookie = "%s=%s; Path=/" % (cookie_name, backend.index)
+                lines = head.split(b"\r\n")[:-2]
+                lines.append(b"Set-Cookie: " + cookie.encode("latin-1"))
+                head = b"\r\n".join(lines) + b"\r\n\r\n"
+        client.sendall(head + rest)
+        self.pipe(upstream, client)
+
+    def serve(self, host, port):
+        """Accept connections until interrupted"""
+
+        listener = socket(AF_INET, SOCK_STREAM)
+        listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(128)
+        self.running = True
+        health = Thread(target=self.check_health)
+        health.daemon = True
+        health.start()
+        try:
+            while self.running:
+                client, address = listener.accept()
+                thread = Thread(target=self.handle, args=(client, address))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.running = False
+            listener.close()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent load generator for a running SageMathCell server"""
+
+from json import loads
+from math import ceil
+from threading import Lock, Thread
+from time import time
+
+try:
+    from urllib import urlencode
+    from urllib2 import Request, urlopen
+except ImportError: # Python 3
+    from urllib.parse import urlencode
+    from urllib.request import Request, urlopen
+
+def post(url, data, timeout):
+    """Send a form POST request, return decoded JSON response"""
+
+    response = urlopen(url, urlencode(data).encode("ascii"), timeout)
+    try:
+        return loads(response.read().decode("utf-8"))
+    finally:
+        response.close()
+
+def delete(url, timeout):
+    """Send a DELETE request"""
+
+    request = Request(url)
+    request.get_method = lambda: "DELETE"
+    urlopen(request, timeout=timeout).close()
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of the values or None"""
+
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(ceil(fraction * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+def summary(values):
+    """Return latency statistics (in seconds)"""
+
+    if not values:
+        return {"count": 0}
+    return {"count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": max(values)}
+
+def run_benchmark(url, snippets, requests, concurrency, timeout=60,
+                  kernel_probes=True):
+    """Send "requests" compute requests from "concurrency" clients
+
+    Snippets are sent in turn to the /service endpoint. With
+    "kernel_probes" every client first asks the /kernel endpoint for a
+    new kernel, the time of it is a kernel acquire time. The kernel is
+    released right away, so that the server is not left with idle
+    kernels.
+    """
+
+    url = url.rstrip('/')
+    lock = Lock()
+    counter = [0]
+    latencies = []
+    acquire_times = []
+    errors = []
+    release_errors = []
+
+    def release(kernel):
+        try:
+            delete("%s/kernel/%s" % (url, kernel["id"]), timeout)
+        except Exception as exception:
+            with lock:
+                release_errors.append(str(exception))
+
+    def client():
+        if kernel_probes:
+            start_time = time()
+            try:
+                kernel = post(url + "/kernel", {"accepted_tos": "true"},
+                              timeout)
+            except Exception as exception:
+                with lock:
+                    errors.append("kernel: %s" % exception)
+            else:
+                with lock:
+                    acquire_times.append(time() - start_time)
+                if "id" in kernel:
+                    release(kernel)
+        while True:
+            with lock:
+                if counter[0] >= requests:
+                    return
+                index = counter[0]
+                counter[0] += 1
+            code = snippets[index % len(snippets)]
+            start_time = time()
+            try:
+                response = post(url + "/service",
+                                {"code": code, "accepted_tos": "true"},
+                                timeout)
+            except Exception as exception:
+                with lock:
+                    errors.append(str(exception))
+                continue
+            with lock:
+                if response.get("success"):
+                    latencies.append(time() - start_time)
+                else:
+                    errors.append("service: %s" % response.get("error",
+                                                               response))
+
+    start_time = time()
+    threads = [Thread(target=client) for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+    duration = time() - start_time
+    attempts = requests + (concurrency if kernel_probes else 0)
+    return {"url": url,
+            "requests": requests,
+            "concurrency": concurrency,
+            "duration": duration,
+            "throughput": len(latencies) / duration if duration else 0.0,
+            "errors": len(errors),
+            "error_rate": float(len(errors)) / attempts if attempts else 0.0,
+            "error_samples": errors[:5],
+            "kernel_release_errors": len(release_errors),
+            "latency": summary(latencies),
+            "kernel_acquire": summary(acquire_times)}
+
+def format_report(results):
+    """Return the benchmark results as a text table"""
+
+    lines = ["%-16s %s" % ("url", results["url"]),
+             "%-16s %s" % ("requests", results["requests"]),
+             "%-16s %s" % ("concurrency", results["concurrency"]),
+             "%-16s %.2f s" % ("duration", results["duration"]),
+             "%-16s %.2f req/s" % ("throughput", results["throughput"]),
+             "%-16s %.2f%% (%s)" % ("error rate",
+                                   results["error_rate"] * 100,
+                                   results["errors"]),
+             "",
+             "%-16s %9s %9s %9s %9s %9s" % ("", "mean", "p50", "p95",
+                                            "p99", "max")]
+    for name in ("latency", "kernel_acquire"):
+        stats = results[name]
+        if stats["count"]:
+            lines.append("%-16s %8.3fs %8.3fs %8.3fs %8.3fs %8.3fs" %
+                         (name.replace('_', ' '), stats["mean"],
+                          stats["p50"], stats["p95"], stats["p99"],
+                          stats["max"]))
+        else:
+            lines.append("%-16s %9s" % (name.replace('_', ' '), "-"))
+    return "\n".join(lines)
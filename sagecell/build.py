@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""Choose parallelism of the Sage build"""
+
+from math import ceil
+from multiprocessing import cpu_count
+from os import getloadavg
+from os.path import exists
+
+def available_memory():
+    """Return available memory in bytes or None"""
+
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            meminfo = dict(line.split(':', 1) for line in f if ':' in line)
+    except IOError:
+        return None
+    if "MemAvailable" in meminfo:
+        kilobytes = int(meminfo["MemAvailable"].split()[0])
+    elif "MemFree" in meminfo: # Linux before 3.14
+        kilobytes = sum(int(meminfo[key].split()[0])
+                        for key in ("MemFree", "Buffers", "Cached")
+                        if key in meminfo)
+    else:
+        return None
+    return kilobytes * 1024
+
+def total_memory():
+    """Return total memory in bytes or None"""
+
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+def cgroup_cpu_limit():
+    """Return the cgroup CPU quota (in CPUs) or None"""
+
+    # cgroup v2
+    if exists("/sys/fs/cgroup/cpu.max"):
+        with open("/sys/fs/cgroup/cpu.max", 'r') as f:
+            quota, period = (f.read().split() + ["100000"])[:2]
+        if quota == "max":
+            return None
+        return float(quota) / float(period)
+    # cgroup v1
+    quota_path = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+    period_path = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+    if exists(quota_path) and exists(period_path):
+        with open(quota_path, 'r') as f:
+            quota = int(f.read())
+        with open(period_path, 'r') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return float(quota) / period
+    return None
+
+def usable_cpus():
+    """Return the number of CPUs allowed by the cgroup quota"""
+
+    try:
+        cpus = cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, int(ceil(limit)))
+    return max(1, cpus)
+
+def build_jobs(memory_per_job):
+    """Return the number of compile jobs for the host
+
+    The number of usable CPUs is reduced by the current load average and
+    limited by available memory per compile job (in bytes).
+    """
+
+    cpus = usable_cpus()
+    jobs = cpus - int(round(getloadavg()[0]))
+    memory = available_memory()
+    if memory is not None:
+        jobs = min(jobs, memory // memory_per_job)
+    return int(max(1, min(jobs, cpus)))
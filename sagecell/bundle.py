@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""Relocatable prebuilt bundle of the sc_build directory"""
+
+from hashlib import sha256
+from json import dump, load
+from multiprocessing.pool import ThreadPool
+from os import readlink, remove, rename, symlink, walk
+from os.path import basename, dirname, islink, join, relpath
+from platform import machine
+from subprocess import CalledProcessError, PIPE, Popen
+from time import time
+
+manifest_name = "bundle.json"
+chunk_size = 1 << 20
+
+def compression(path):
+    """Return compress and decompress commands for the bundle file"""
+
+    if path.endswith(".zst"):
+        return ["zstd", "-T0", "-q", "-c"], ["zstd", "-d", "-q", "-c"]
+    elif path.endswith(".xz"):
+        # Parallel decompression requires xz 5.4
+        return ["xz", "-T0", "-c"], ["xz", "-d", "-T0", "-c"]
+    raise ValueError("unknown bundle format: %s" % basename(path))
+
+def pipeline(first, second, stdin=None, stdout=None):
+    """Run "first | second", raise CalledProcessError on failure"""
+
+    source = Popen(first, stdin=stdin, stdout=PIPE)
+    target = Popen(second, stdin=source.stdout, stdout=stdout)
+    # The target gets EOF, when the source exits
+    source.stdout.close()
+    target.wait()
+    source.wait()
+    for process, command in ((source, first), (target, second)):
+        if process.returncode:
+            raise CalledProcessError(process.returncode, " ".join(command))
+
+def scan_file(path, prefix):
+    """Return SHA256 of the file and whether it is text with the prefix"""
+
+    digest = sha256()
+    found = False
+    text = True
+    tail = b""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if text and b"\0" in chunk:
+                text = False
+            # The prefix may cross a chunk boundary
+            if not found and prefix in tail + chunk:
+                found = True
+            tail = chunk[-len(prefix):]
+    return digest.hexdigest(), found and text
+
+def walk_files(root, exclude=()):
+    """Yield relative paths of files and symlinks under the root"""
+
+    for dir_path, dir_names, file_names in walk(root):
+        rel_dir = relpath(dir_path, root)
+        kept = []
+        for name in dir_names:
+            rel_path = join(rel_dir, name) if rel_dir != "." else name
+            if rel_path in exclude:
+                continue
+            # Symlinks to directories are not followed by walk
+            if islink(join(dir_path, name)):
+                yield rel_path
+            else:
+                kept.append(name)
+        dir_names[:] = kept
+        for name in file_names:
+            rel_path = join(rel_dir, name) if rel_dir != "." else name
+            if rel_path not in exclude and rel_path != manifest_name:
+                yield rel_path
+
+def create_manifest(root, exclude=(), jobs=1):
+    """Return the manifest of files under the root
+
+    Every file gets SHA256. Text files which contain the absolute path
+    of the root are listed for relocation to another home directory.
+    """
+
+    prefix = root.encode("utf-8")
+    files = {}
+    links = {}
+    paths = []
+    for rel_path in walk_files(root, exclude):
+        if islink(join(root, rel_path)):
+            links[rel_path] = readlink(join(root, rel_path))
+        else:
+            paths.append(rel_path)
+    pool = ThreadPool(jobs)
+    try:
+        results = pool.map(lambda rel_path: scan_file(join(root, rel_path),
+                                                      prefix),
+                           paths, chunksize=64)
+    finally:
+        pool.close()
+    relocate = []
+    for rel_path, (digest, found) in zip(paths, results):
+        files[rel_path] = digest
+        if found:
+            relocate.append(rel_path)
+    return {"version": 1,
+            "created": int(time()),
+            "machine": machine(),
+            "prefix": root,
+            "exclude": list(exclude),
+            "files": files,
+            "links": links,
+            "relocate": sorted(relocate)}
+
+def pack(root, bundle_path, exclude=(), jobs=1, extra=None):
+    """Write the root directory with a manifest to a compressed tar
+
+    Return the manifest.
+    """
+
+    compress, decompress = compression(bundle_path)
+    manifest = create_manifest(root, exclude, jobs)
+    manifest.update(extra or {})
+    manifest_path = join(root, manifest_name)
+    with open(manifest_path, 'w') as f:
+        dump(manifest, f, sort_keys=True)
+    command = ["tar", "-C", dirname(root), "-cf", "-"]
+    command += ["--exclude=%s" % join(basename(root), rel_path)
+                for rel_path in exclude]
+    command.append(basename(root))
+    temp_path = bundle_path + ".tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            pipeline(command, compress, stdout=f)
+        rename(temp_path, bundle_path)
+    finally:
+        remove(manifest_path)
+    return manifest
+
+def read_manifest(root):
+    """Return the manifest of the unpacked bundle"""
+
+    with open(join(root, manifest_name), 'r') as f:
+        return load(f)
+
+def unpack(bundle_path, parent_path):
+    """Unpack the bundle into the parent directory"""
+
+    compress, decompress = compression(bundle_path)
+    with open(bundle_path, 'rb') as f:
+        pipeline(decompress, ["tar", "-C", parent_path, "-xf", "-"],
+                 stdin=f)
+
+def verify(root, manifest, jobs=1):
+    """Return relative paths of missing and changed files"""
+
+    prefix = manifest["prefix"].encode("utf-8")
+
+    def check(item):
+        rel_path, digest = item
+        try:
+            if scan_file(join(root, rel_path), prefix)[0] == digest:
+                return None
+        except IOError: # Missing file
+            pass
+        return rel_path
+
+    pool = ThreadPool(jobs)
+    try:
+        results = pool.map(check, sorted(manifest["files"].items()),
+                           chunksize=64)
+    finally:
+        pool.close()
+    bad = [rel_path for rel_path in results if rel_path is not None]
+    for rel_path, target in manifest["links"].items():
+        path = join(root, rel_path)
+        if not islink(path) or readlink(path) != target:
+            bad.append(rel_path)
+    return sorted(bad)
+
+def relocate(root, manifest):
+    """Replace the old root path in text files and symlinks
+
+    Return the number of changed files. Binary files are left to the
+    Sage relocation (sage-location) on the first start.
+    """
+
+    old_prefix = manifest["prefix"]
+    if old_prefix == root:
+        return 0
+    old_bytes = old_prefix.encode("utf-8")
+    new_bytes = root.encode("utf-8")
+    for rel_path in manifest["relocate"]:
+        path = join(root, rel_path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Rewrite in place, so that the file keeps its mode
+        with open(path, 'wb') as f:
+            f.write(data.replace(old_bytes, new_bytes))
+    changed = len(manifest["relocate"])
+    for rel_path, target in manifest["links"].items():
+        if target.startswith(old_prefix + "/"):
+            path = join(root, rel_path)
+            remove(path)
+            symlink(root + target[len(old_prefix):], path)
+            changed += 1
+    return changed
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""Roll out the SageMathCell to many hosts"""
+
+from os.path import basename, expanduser, join, realpath
+from subprocess import call, check_call, STDOUT
+from threading import Lock
+from time import sleep, time
+
+from .scheduler import run_steps, Step, StepError
+from .supervisor import is_ready
+
+def read_hosts(path):
+    """Return hosts of the file: one [user@]host per line, # comments"""
+
+    hosts = []
+    with open(path, 'r') as f:
+        for line in f:
+            host = line.split('#', 1)[0].strip()
+            if host and host not in hosts:
+                hosts.append(host)
+    return hosts
+
+def hostname(host):
+    """Return the host name without a user name"""
+
+    return host.rpartition('@')[2]
+
+def has_command(name):
+    """Check the command is on PATH"""
+
+    return call("command -v %s > /dev/null" % name, shell=True) == 0
+
+def wait_healthy(url, timeout, interval=1):
+    """Wait until the server at the URL is ready"""
+
+    deadline = time() + timeout
+    while time() < deadline:
+        if is_ready(url):
+            return True
+        sleep(interval)
+    return False
+
+class Transport(object):
+    """Run commands and copy files on a host
+
+    Commands run in the home directory of the host user, remote paths are
+    relative to it. Output goes to the "log" file object.
+    """
+
+    def __init__(self, host, log):
+        self.host = host
+        self.log = log
+
+    def run(self, command):
+        """Run the shell command, raise CalledProcessError on failure"""
+
+        raise NotImplementedError
+
+    def copy(self, path, remote_path, bwlimit=None):
+        """Copy the local file, "bwlimit" is in KiB/s"""
+
+        raise NotImplementedError
+
+    def check_ready(self, url, timeout):
+        """Wait until the server is ready or raise RuntimeError"""
+
+        if not wait_healthy(url, timeout):
+            raise RuntimeError("%s is not ready after %s s" % (url, timeout))
+
+class LocalTransport(Transport):
+    """Transport to this machine, e.g. for testing with localhost"""
+
+    def run(self, command):
+        check_call(["sh", "-c", command], cwd=expanduser("~"),
+                   stdout=self.log, stderr=STDOUT)
+
+    def copy(self, path, remote_path, bwlimit=None):
+        # No network, no bandwidth limit
+        target = join(expanduser("~"), remote_path)
+        # The bundle is packed in the home directory usually
+        if realpath(path) == realpath(target):
+            return
+        check_call(["cp", path, target], stdout=self.log, stderr=STDOUT)
+
+class SshTransport(Transport):
+    """Transport over SSH with key based login (see "sagecell ssh")"""
+
+    options = ["-o", "BatchMode=yes", "-o", "ConnectTimeout=10"]
+
+    def run(self, command):
+        check_call(["ssh"] + self.options + [self.host, command],
+                   stdout=self.log, stderr=STDOUT)
+
+    def copy(self, path, remote_path, bwlimit=None):
+        target = "%s:%s" % (self.host, remote_path)
+        # rsync resumes an interrupted copy of a large bundle
+        if has_command("rsync"):
+            command = ["rsync", "--partial",
+                       "-e", " ".join(["ssh"] + self.options)]
+            if bwlimit:
+                command.append("--bwlimit=%s" % bwlimit)
+        else:
+            command = ["scp", "-q"] + self.options
+            if bwlimit:
+                command += ["-l", str(bwlimit * 8)] # Kbit/s
+        check_call(command + [path, target], stdout=self.log,
+                   stderr=STDOUT)
+
+class DryRunTransport(Transport):
+    """Print commands instead of running them
+
+    Texts come from the "messages" dict (see config/messages.txt).
+    """
+
+    def __init__(self, host, log, messages):
+        Transport.__init__(self, host, log)
+        self.messages = messages
+
+    def run(self, command):
+        print(self.messages["_dry_run_command"] % (self.host, command))
+
+    def copy(self, path, remote_path, bwlimit=None):
+        if bwlimit:
+            print(self.messages["_dry_run_copy_bwlimit"] %
+                  (self.host, path, remote_path, bwlimit))
+        else:
+            print(self.messages["_dry_run_copy"] %
+                  (self.host, path, remote_path))
+
+    def check_ready(self, url, timeout):
+        print(self.messages["_dry_run_ready"] % (self.host, url))
+
+transports = {"dry-run": DryRunTransport,
+              "local": LocalTransport,
+              "ssh": SshTransport}
+
+def deploy(hosts, transport_factory, log_path, bundle_path=None,
+           install=False, restart_command=None, port=8888, jobs=4,
+           bwlimit=None, min_healthy=None, ready_timeout=300):
+    """Copy the bundle, install and restart the SageMathCell on hosts
+
+    At most "jobs" hosts are handled at a time, "bwlimit" (KiB/s) is
+    shared by parallel copies. With "min_healthy", at most "len(hosts) -
+    min_healthy" hosts are installed and restarted at a time (a rolling
+    restart) and every restarted host must pass a readiness check. After
+    the first failure no new hosts are started. Return a dict of host
+    statuses: "status" (ok, failed or not started), "error" and
+    durations of "copy", "install", "restart" and "ready".
+    """
+
+    jobs = max(1, min(jobs, len(hosts)))
+    width = jobs
+    if min_healthy is not None:
+        width = len(hosts) - min_healthy
+        if width < 1:
+            raise ValueError("%s hosts can not keep %s healthy servers" %
+                             (len(hosts), min_healthy))
+    if bwlimit:
+        bwlimit = max(1, bwlimit // jobs)
+    remote_bundle = basename(bundle_path) if bundle_path else None
+    lock = Lock()
+    results = dict((host, {"status": "not started"}) for host in hosts)
+    steps = []
+
+    def timed(host, name, function, *args):
+        start_time = time()
+        try:
+            return function(*args)
+        except Exception as exception:
+            with lock:
+                results[host]["status"] = "failed"
+                results[host]["error"] = "%s: %s" % (name, exception)
+            raise
+        finally:
+            with lock:
+                results[host][name] = time() - start_time
+
+    def copy_step(host, transport):
+        def copy_bundle(runner):
+            timed(host, "copy", transport.copy, bundle_path, remote_bundle,
+                  bwlimit)
+        return copy_bundle
+
+    def rollout_step(host, transport):
+        def rollout(runner):
+            # Answer "y" to questions of the installer
+            if remote_bundle:
+                timed(host, "install", transport.run,
+                      "yes 2> /dev/null | "
+                      "sagecell install --from-bundle %s" % remote_bundle)
+            elif install:
+                timed(host, "install", transport.run,
+                      "yes 2> /dev/null | sagecell install --resume")
+            if restart_command:
+                timed(host, "restart", transport.run, restart_command)
+            if restart_command or min_healthy is not None:
+                url = "http://%s:%s/" % (hostname(host), port)
+                timed(host, "ready", transport.check_ready, url,
+                      ready_timeout)
+            with lock:
+                results[host]["status"] = "ok"
+        return rollout
+
+    logs = []
+    try:
+        for index, host in enumerate(hosts):
+            log = open(join(log_path, "%s.log" % host), 'a')
+            logs.append(log)
+            transport = transport_factory(host, log)
+            requires = []
+            if bundle_path:
+                steps.append(Step("copy %s" % host,
+                                  copy_step(host, transport)))
+                requires.append("copy %s" % host)
+            # Hosts of one lane are taken down one after another
+            steps.append(Step("rollout %s" % host,
+                              rollout_step(host, transport),
+                              requires=requires,
+                              locks=["lane %s" % (index % width)]))
+        try:
+            run_steps(steps, None, jobs)
+        except StepError:
+            # Failed hosts are marked by "timed"
+            pass
+    finally:
+        for log in logs:
+            log.close()
+    return results
+
+def format_summary(hosts, results):
+    """Return per-host statuses and timings as a text table"""
+
+    names = ("copy", "install", "restart", "ready")
+    width = max([len(host) for host in hosts] + [4])
+    lines = ["%-*s %-12s" % (width, "host", "status") +
+             "".join("%9s" % name for name in names)]
+    for host in hosts:
+        result = results[host]
+        line = "%-*s %-12s" % (width, host, result["status"])
+        for name in names:
+            if name in result:
+                line += "%8.1fs" % result[name]
+            else:
+                line += "%9s" % "-"
+        if "error" in result:
+            line += "  " + result["error"]
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""Content-addressed cache of downloaded files"""
+
+from hashlib import sha256
+from json import dump, load
+from os import chmod, close, listdir, makedirs, remove, rename
+from os.path import basename, exists, isdir, join, splitext
+from re import sub
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+try:
+    from urlparse import urlparse
+except ImportError: # Python 3
+    from urllib.parse import urlparse
+
+class DownloadError(IOError):
+    """A file can not be downloaded or is not in the cache (offline)"""
+
+def file_sha256(path):
+    """Return SHA256 of the file"""
+
+    digest = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def distribution_key(name, version):
+    """Return the normalized (name, version) of a Python distribution"""
+
+    return sub(r"[-_.]+", "-", name).lower(), version
+
+def missing_distributions(path, requirements):
+    """Return [(name, version)] of "requirements" not in the directory
+
+    Wheels and source archives (as "pip download" saves them) count.
+    """
+
+    present = set()
+    if isdir(path):
+        for file_name in listdir(path):
+            if file_name.endswith(".whl"):
+                fields = file_name.split('-')
+            else:
+                for extension in (".tar.gz", ".tar.bz2", ".zip"):
+                    if file_name.endswith(extension):
+                        fields = file_name[:-len(extension)].rsplit('-', 1)
+                        break
+                else:
+                    continue
+            if len(fields) >= 2:
+                present.add(distribution_key(fields[0], fields[1]))
+    return [(name, version) for name, version in requirements
+            if distribution_key(name, version) not in present]
+
+class DownloadCache(object):
+    """Files stored by SHA256 of their content, found by their URL
+
+    "objects/SHA256.EXT" files keep the extension of the URL, so that
+    tools which look at it (npm) accept them. "index.json" maps URLs to
+    hashes. An object is checked against its hash on every use. With
+    "offline" nothing is downloaded.
+    """
+
+    def __init__(self, path, offline=False):
+        self.path = path
+        self.objects_path = join(path, "objects")
+        self.index_path = join(path, "index.json")
+        self.offline = offline
+        self.lock = Lock()
+        self.index = {}
+        if exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = load(f)
+
+    def save(self):
+        """Write the index atomically"""
+
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            dump(self.index, f, indent=2, separators=(',', ': '),
+                 sort_keys=True)
+        rename(temp_path, self.index_path)
+
+    def object_path(self, digest, url):
+        """Return a path of the object for the hash"""
+
+        return join(self.objects_path,
+                    digest + splitext(urlparse(url).path)[1])
+
+    def cached(self, url):
+        """Return a path of the valid cached file for the URL or None"""
+
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is None:
+            return None
+        path = self.object_path(entry["sha256"], url)
+        if exists(path) and file_sha256(path) == entry["sha256"]:
+            return path
+        return None
+
+    def fetch(self, run, url):
+        """Return a path of the cached file, download it if needed
+
+        "run" executes the download command.
+        """
+
+        path = self.cached(url)
+        if path is not None:
+            return path
+        if self.offline:
+            raise DownloadError("%s is not in the download cache" % url)
+        with self.lock:
+            if not isdir(self.objects_path):
+                makedirs(self.objects_path)
+        handle, temp_path = mkstemp(dir=self.objects_path,
+                                    prefix=".download-")
+        close(handle)
+        try:
+            run("curl -fsSL -o %s %s" % (temp_path, url))
+            digest = file_sha256(temp_path)
+            path = self.object_path(digest, url)
+            # Installers run as root or another user
+            chmod(temp_path, 0o644)
+            rename(temp_path, path)
+        except BaseException:
+            if exists(temp_path):
+                remove(temp_path)
+            raise
+        with self.lock:
+            self.index[url] = {"sha256": digest, "fetched": int(time()),
+                               "name": basename(urlparse(url).path)}
+            self.save()
+        return path
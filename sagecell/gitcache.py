@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent cache of bare git mirrors"""
+
+from os.path import dirname, isdir, join
+from re import sub
+from subprocess import CalledProcessError, check_output, STDOUT
+try:
+    from urlparse import urljoin
+except ImportError: # Python 3
+    from urllib.parse import urljoin
+
+def mirror_path(cache_path, url):
+    """Return a path of the bare mirror for the repository URL"""
+
+    # https://github.com/novoselt/sage.git -> github.com/novoselt/sage.git
+    name = sub(r"^[a-z+]+://([^@/]*@)?", "", url).strip('/')
+    if not name.endswith(".git"):
+        name += ".git"
+    return join(cache_path, name)
+
+def update_mirror(run, cache_path, url, source=None):
+    """Create or update the bare mirror of the repository
+
+    "source" is a local clone to fill the mirror from instead of the URL.
+    """
+
+    path = mirror_path(cache_path, url)
+    if isdir(path):
+        if source is None:
+            run("cd %s; git remote update --prune" % path)
+        else:
+            run("cd %s; git fetch --prune %s '+refs/heads/*:refs/heads/*' "
+                "'+refs/tags/*:refs/tags/*'" % (path, source))
+    else:
+        run("mkdir -p %s" % dirname(path))
+        run("git clone --mirror %s %s" % (source or url, path))
+        # Next updates without a source go to the network
+        run("cd %s; git remote set-url origin %s" % (path, url))
+    return path
+
+def submodule_urls(mirror, url, ref="HEAD"):
+    """Return URLs of submodules of the mirror at the ref
+
+    Relative URLs are resolved against the repository URL, as git does.
+    """
+
+    try:
+        output = check_output("git --git-dir=%s config --blob %s:.gitmodules "
+                              "--get-regexp '^submodule\\..*\\.url$'" %
+                              (mirror, ref), shell=True, stderr=STDOUT)
+    except CalledProcessError: # No .gitmodules
+        return []
+    urls = []
+    for line in output.decode("utf-8").splitlines():
+        submodule_url = line.split(None, 1)[1].strip()
+        if submodule_url.startswith(("./", "../")):
+            submodule_url = urljoin(url.rstrip('/') + '/', submodule_url)
+        urls.append(submodule_url)
+    return urls
+
+def update_submodule_mirrors(run, cache_path, url, branch):
+    """Create or update mirrors of submodules (recursively)
+
+    Return the URLs of the submodules.
+    """
+
+    urls = []
+    pending = submodule_urls(mirror_path(cache_path, url), url,
+                             "refs/heads/%s" % branch)
+    while pending:
+        submodule_url = pending.pop(0)
+        if submodule_url in urls:
+            continue
+        urls.append(submodule_url)
+        path = update_mirror(run, cache_path, submodule_url)
+        # Nested submodules of the default branch
+        pending += submodule_urls(path, submodule_url)
+    return urls
+
+def submodule_mirrors(cache_path, url, branch):
+    """Return {URL: mirror path} of the cached submodule mirrors"""
+
+    mirrors = {}
+    pending = submodule_urls(mirror_path(cache_path, url), url,
+                             "refs/heads/%s" % branch)
+    while pending:
+        submodule_url = pending.pop(0)
+        path = mirror_path(cache_path, submodule_url)
+        if submodule_url in mirrors or not isdir(path):
+            continue
+        mirrors[submodule_url] = path
+        pending += submodule_urls(path, submodule_url)
+    return mirrors
+
+def checkout(run, mirror, url, path, branch, submodules=None):
+    """Clone from the mirror or update an existing checkout
+
+    A clone from a local mirror hard-links objects, so it needs neither
+    network nor a copy of the history. "submodules" is a dict of mirrors
+    (see "submodule_mirrors") to fetch submodules from instead of their
+    URLs.
+    """
+
+    if isdir(join(path, ".git")):
+        run("cd %s; git fetch %s '+refs/heads/*:refs/remotes/origin/*'" %
+            (path, mirror))
+        run("cd %s; git checkout -f -B %s origin/%s" % (path, branch, branch))
+    else:
+        # Remove a partial clone
+        run("rm -rf %s" % path)
+        run("git clone --branch %s %s %s" % (branch, mirror, path))
+        run("cd %s; git remote set-url origin %s" % (path, url))
+    # Passed to git processes of nested submodules too, git 2.38 refuses
+    # local submodule clones by default
+    options = ""
+    if submodules:
+        options = " -c protocol.file.allow=always"
+    options += "".join(" -c url.%s.insteadOf=%s" % (submodule_mirror,
+                                                   submodule_url)
+                      for submodule_url, submodule_mirror in
+                      sorted((submodules or {}).items()))
+    run("cd %s; git%s submodule update --init --recursive" % (path, options))
+
+def mirror_head(cache_path, url, branch):
+    """Return the commit SHA of the branch in the mirror or None"""
+
+    path = mirror_path(cache_path, url)
+    try:
+        sha = check_output("git --git-dir=%s rev-parse refs/heads/%s" %
+                           (path, branch), shell=True, stderr=STDOUT)
+    except CalledProcessError:
+        return None
+    return sha.strip()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""Journal of completed installation steps"""
+
+from json import dump, dumps, load, loads
+from os import rename
+from os.path import exists
+from threading import Lock
+from time import time
+
+class Journal(object):
+    """Completed steps with their inputs and duration, stored as JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = Lock()
+        if exists(path):
+            with open(path, 'r') as f:
+                self.entries = load(f)
+
+    def get(self, name):
+        """Return the journal entry of the step or None"""
+
+        with self.lock:
+            return self.entries.get(name)
+
+    def is_complete(self, name, inputs):
+        """Check the step is completed with the same inputs"""
+
+        entry = self.get(name)
+        if entry is None:
+            return False
+        # Compare in the JSON form, e.g. tuples are stored as lists
+        return entry["inputs"] == loads(dumps(inputs))
+
+    def record(self, name, inputs, duration, **extra):
+        """Record the completed step and save the journal"""
+
+        entry = {"inputs": inputs, "duration": round(duration, 3),
+                 "finished": time()}
+        entry.update(extra)
+        with self.lock:
+            self.entries[name] = loads(dumps(entry))
+            self.save()
+
+    def save(self):
+        """Save the journal atomically"""
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            dump(self.entries, f, indent=2, separators=(',', ': '),
+                 sort_keys=True)
+        rename(temp_path, self.path)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""Stream permalinks between SageMathCell sqlite databases"""
+
+from base64 import b64decode, b64encode
+from json import dumps, loads
+from sqlite3 import connect as sqlite_connect
+
+try:
+    binary_type = buffer # Python 2 BLOB values
+except NameError: # Python 3
+    binary_type = bytes
+
+def connect(path, timeout=30):
+    """Open the database for sharing with a running server
+
+    WAL lets the server read and write during a sync, writers wait up to
+    "timeout" seconds for a lock.
+    """
+
+    connection = sqlite_connect(path, timeout)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+def quote(name):
+    """Return the quoted SQL identifier"""
+
+    return '"%s"' % name.replace('"', '""')
+
+def table_schema(connection, table):
+    """Return [name, type, primary key position] of the table columns"""
+
+    return [[row[1], row[2], row[5]] for row in
+            connection.execute("PRAGMA table_info(%s)" % quote(table))]
+
+def prepare_table(connection, table, schema, watermark):
+    """Create the table (if needed) and the index of the watermark column"""
+
+    keys = [name for name, type_, pk in sorted(schema, key=lambda c: c[2])
+            if pk]
+    columns = ["%s %s" % (quote(name), type_) for name, type_, pk in schema]
+    if keys:
+        columns.append("PRIMARY KEY (%s)" % ", ".join(map(quote, keys)))
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS %s (%s)" %
+                           (quote(table), ", ".join(columns)))
+        connection.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" %
+                           (quote("ix_%s_%s" % (table, watermark)),
+                            quote(table), quote(watermark)))
+
+def export_rows(connection, table, watermark, since=None, batch_size=1000):
+    """Yield a header, rows and a trailer as JSON-compatible values
+
+    Rows with the watermark column not older than "since" are yielded in
+    the watermark order. Rows at the "since" value itself are sent again,
+    so that rows created within the same second are not lost. BLOB values
+    are sent as {"base64": text}. The trailer holds the new watermark.
+    """
+
+    schema = table_schema(connection, table)
+    if not schema:
+        raise ValueError("no table '%s'" % table)
+    names = [name for name, type_, pk in schema]
+    if watermark not in names:
+        raise ValueError("no column '%s' in the '%s' table" %
+                         (watermark, table))
+    yield {"table": table, "schema": schema, "watermark_column": watermark,
+           "since": since}
+    query = "SELECT %s FROM %s" % (", ".join(map(quote, names)),
+                                   quote(table))
+    parameters = ()
+    if since is not None:
+        query += " WHERE %s >= ?" % quote(watermark)
+        parameters = (since,)
+    query += " ORDER BY %s" % quote(watermark)
+    index = names.index(watermark)
+    rows = 0
+    last = since
+    cursor = connection.execute(query, parameters)
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        for row in batch:
+            yield [{"base64": b64encode(bytes(value)).decode("ascii")}
+                   if isinstance(value, binary_type) else value
+                   for value in row]
+        rows += len(batch)
+        if batch[-1][index] is not None:
+            last = batch[-1][index]
+    yield {"rows": rows, "watermark": last}
+
+def write_lines(items, f):
+    """Write values as compact JSON lines into the binary file"""
+
+    for item in items:
+        f.write((dumps(item, separators=(',', ':')) + "\n").encode("utf-8"))
+
+def read_lines(f):
+    """Yield values of JSON lines of the binary file"""
+
+    for line in f:
+        if line.strip():
+            yield loads(line.decode("utf-8"))
+
+def import_rows(connection, items, update=True, batch_size=1000):
+    """Insert (or update, if "update") rows of "export_rows" items
+
+    Every batch is a separate transaction, so that the server is not
+    blocked for the whole import. Return counts of "rows", "inserted" and
+    "updated" rows and the "watermark" of the trailer.
+    """
+
+    items = iter(items)
+    try:
+        header = next(items)
+    except StopIteration:
+        # E.g. the export on a remote host failed
+        raise ValueError("no header in the import, the input is empty")
+    if not isinstance(header, dict) or "table" not in header:
+        raise ValueError("no header in the import")
+    table = header["table"]
+    schema = header["schema"]
+    prepare_table(connection, table, schema, header["watermark_column"])
+    # Imported columns must exist in the target table
+    existing = set(name for name, type_, pk in
+                   table_schema(connection, table))
+    names = [name for name, type_, pk in schema]
+    missing = [name for name in names if name not in existing]
+    if missing:
+        raise ValueError("no columns %s in the '%s' table" %
+                         (", ".join(missing), table))
+    keys = [name for name, type_, pk in schema if pk]
+    values = [name for name in names if name not in keys]
+    insert = "INSERT OR IGNORE INTO %s (%s) VALUES (%s)" % (
+        quote(table), ", ".join(map(quote, names)),
+        ", ".join("?" * len(names)))
+    key_indexes = [names.index(name) for name in keys]
+    value_indexes = [names.index(name) for name in values]
+    update_query = "UPDATE %s SET %s WHERE %s" % (
+        quote(table), ", ".join("%s = ?" % quote(name) for name in values),
+        " AND ".join("%s = ?" % quote(name) for name in keys))
+    counts = {"rows": 0, "inserted": 0, "updated": 0, "watermark": None}
+
+    def flush(batch):
+        with connection:
+            before = connection.total_changes
+            connection.executemany(insert, batch)
+            inserted = connection.total_changes - before
+            counts["inserted"] += inserted
+            if update and keys and values:
+                # Just inserted rows are updated too
+                before = connection.total_changes
+                connection.executemany(update_query, (
+                    [row[i] for i in value_indexes] +
+                    [row[i] for i in key_indexes] for row in batch))
+                counts["updated"] += (connection.total_changes - before -
+                                      inserted)
+        counts["rows"] += len(batch)
+
+    batch = []
+    for item in items:
+        if isinstance(item, dict):
+            counts["watermark"] = item.get("watermark")
+            continue
+        batch.append([binary_type(b64decode(value["base64"]))
+                      if isinstance(value, dict) else value
+                      for value in item])
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return counts
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""Install apt packages in a single transaction"""
+
+from os.path import exists, getmtime
+from subprocess import PIPE, Popen
+from time import time
+
+# Files touched by a successful "apt-get update"
+apt_update_stamps = ["/var/lib/apt/periodic/update-success-stamp",
+                     "/var/lib/apt/lists/partial", "/var/lib/apt/lists"]
+
+def installed_packages(packages):
+    """Return a set of the installed packages, ask dpkg only once"""
+
+    if not packages:
+        return set()
+    command = ["dpkg-query", "-W", "-f", "${Package} ${Status}\\n"]
+    try:
+        process = Popen(command + list(packages), stdout=PIPE,
+                        stderr=PIPE, universal_newlines=True)
+    except OSError: # No dpkg
+        return set()
+    # dpkg-query returns 1 for unknown packages, but still lists the rest
+    output = process.communicate()[0]
+    installed = set()
+    for line in output.splitlines():
+        fields = line.split()
+        if fields and fields[-1] == "installed":
+            installed.add(fields[0].split(':')[0]) # Strip ":amd64"
+    return installed
+
+def package_lists_age():
+    """Return seconds since the last "apt-get update" or None"""
+
+    mtimes = [getmtime(path) for path in apt_update_stamps if exists(path)]
+    if not mtimes:
+        return None
+    return max(0, time() - max(mtimes))
+
+class PackagePlan(object):
+    """Collect required packages and install only the missing ones
+
+    "update_ttl" is a maximum age (in seconds) of the package lists,
+    older lists are refreshed by "apt-get update" before installation.
+    """
+
+    def __init__(self, packages=(), update_ttl=0):
+        self.packages = []
+        self.upgrades = set()
+        self.update_ttl = update_ttl
+        self.add(packages)
+
+    def add(self, packages, upgrade=False):
+        """Add packages, "upgrade" installs them even if present"""
+
+        for package in packages:
+            if package not in self.packages:
+                self.packages.append(package)
+            if upgrade:
+                self.upgrades.add(package)
+
+    def missing(self):
+        """Return packages for installation"""
+
+        installed = installed_packages(self.packages)
+        return [package for package in self.packages
+                if package in self.upgrades or package not in installed]
+
+    def commands(self):
+        """Return apt-get commands without superuser prefix"""
+
+        missing = self.missing()
+        if not missing:
+            return []
+        commands = []
+        age = package_lists_age()
+        if age is None or age > self.update_ttl:
+            commands.append("apt-get update")
+        commands.append("apt-get install -y %s" % " ".join(missing))
+        return commands
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""Time, CPU, memory and I/O of installation steps"""
+
+from logging import Formatter, getLogger, INFO
+from logging.handlers import RotatingFileHandler
+from os import close, remove, wait4, WEXITSTATUS, WIFEXITED, WTERMSIG
+from re import compile as re_compile
+from subprocess import CalledProcessError, PIPE, Popen, STDOUT
+from tempfile import mkstemp
+from threading import current_thread, local, Lock
+from time import time
+
+# "su -c" and "sudo" (see as_root) may ask for a password
+root_pattern = re_compile(r"(?:^|[;&|]\s*)(?:su|sudo)\s")
+
+def network_received():
+    """Return bytes received by all network interfaces except lo"""
+
+    received = 0
+    try:
+        with open("/proc/net/dev", 'r') as f:
+            for line in f.readlines()[2:]:
+                interface, colon, counters = line.partition(':')
+                if interface.strip() != "lo":
+                    received += int(counters.split()[0])
+    except IOError:
+        pass
+    return received
+
+def read_io(path):
+    """Return counters of a /proc/PID/io copy"""
+
+    counters = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                key, colon, value = line.partition(':')
+                if colon:
+                    counters[key.strip()] = int(value)
+    except (IOError, ValueError):
+        pass
+    return counters
+
+class Profiler(object):
+    """Command runner which traces steps of the scheduler
+
+    Output of commands goes to a rotating log with step prefixes. Every
+    command gets wall and CPU time, peak RSS (the largest process of its
+    tree) and bytes read and written by the tree. Steps also get bytes
+    received by the host during the step, shared by parallel steps.
+    Errors of commands run as root stay on the terminal, so that their
+    password prompts are seen.
+    """
+
+    def __init__(self, log_path, log_size, log_backups=3,
+                 report=lambda name, stats: None):
+        self.origin = time()
+        self.lock = Lock()
+        self.current = local()
+        self.events = []
+        self.steps = {}
+        self.threads = {}
+        self.report = report
+        self.logger = getLogger("sagecell.install")
+        self.logger.setLevel(INFO)
+        self.logger.propagate = False
+        self.handler = RotatingFileHandler(log_path, maxBytes=log_size,
+                                           backupCount=log_backups)
+        self.handler.setFormatter(Formatter("%(asctime)s %(message)s"))
+        self.logger.addHandler(self.handler)
+
+    def close(self):
+        """Close the log"""
+
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def thread_id(self):
+        """Return a small number of the current thread for the trace"""
+
+        with self.lock:
+            return self.threads.setdefault(current_thread().ident,
+                                           len(self.threads) + 1)
+
+    def event(self, name, category, start_time, args):
+        """Add a complete ("X") event of the Chrome trace format"""
+
+        event = {"name": name, "cat": category, "ph": "X",
+                 "ts": int((start_time - self.origin) * 1e6),
+                 "dur": int((time() - start_time) * 1e6),
+                 "pid": 1, "tid": self.thread_id(), "args": args}
+        with self.lock:
+            self.events.append(event)
+
+    def start(self, step):
+        """Start the step in the current thread"""
+
+        self.current.step = step.name
+        self.current.start_time = time()
+        self.current.received = network_received()
+        self.current.stats = {"cpu": 0.0, "max_rss": 0, "read_bytes": 0,
+                              "write_bytes": 0, "commands": 0}
+        self.logger.info("[%s] started", step.name)
+
+    def finish(self, step, error=None):
+        """Finish the step in the current thread"""
+
+        stats = self.current.stats
+        stats["wall"] = time() - self.current.start_time
+        stats["received"] = network_received() - self.current.received
+        stats["error"] = None if error is None else str(error)
+        self.event(step.name, "step", self.current.start_time, stats)
+        with self.lock:
+            self.steps[step.name] = stats
+        self.logger.info("[%s] %s in %.1f s", step.name,
+                         "failed" if error else "finished", stats["wall"])
+        self.current.step = None
+        self.report(step.name, stats)
+
+    def __call__(self, command):
+        """Run the shell command, raise CalledProcessError on failure"""
+
+        step = getattr(self.current, "step", None) or "-"
+        # The shell collects I/O counters of its finished children
+        handle, io_path = mkstemp(prefix="sagecell-io-")
+        close(handle)
+        script = ("%s\nstatus=$?\ncat /proc/$$/io > %s 2> /dev/null\n"
+                  "exit $status" % (command, io_path))
+        self.logger.info("[%s] $ %s", step, command)
+        start_time = time()
+        stderr = STDOUT
+        if root_pattern.search(command):
+            stderr = None
+        process = Popen(["/bin/sh", "-c", script], stdout=PIPE,
+                        stderr=stderr)
+        try:
+            for line in iter(process.stdout.readline, b""):
+                self.logger.info("[%s] %s", step,
+                                 line.rstrip().decode("utf-8", "replace"))
+            # wait4 returns resources of the whole reaped process tree
+            pid, status, usage = wait4(process.pid, 0)
+        finally:
+            process.stdout.close()
+        if WIFEXITED(status):
+            process.returncode = WEXITSTATUS(status)
+        else:
+            process.returncode = -WTERMSIG(status)
+        counters = read_io(io_path)
+        remove(io_path)
+        args = {"cpu": usage.ru_utime + usage.ru_stime,
+                "max_rss": usage.ru_maxrss * 1024,
+                "read_bytes": counters.get("read_bytes", 0),
+                "write_bytes": counters.get("write_bytes", 0),
+                "returncode": process.returncode}
+        self.event(command[:80], "command", start_time, args)
+        stats = getattr(self.current, "stats", None)
+        if stats is not None:
+            stats["cpu"] += args["cpu"]
+            stats["max_rss"] = max(stats["max_rss"], args["max_rss"])
+            stats["read_bytes"] += args["read_bytes"]
+            stats["write_bytes"] += args["write_bytes"]
+            stats["commands"] += 1
+        if process.returncode:
+            self.logger.info("[%s] exit code %s", step, process.returncode)
+            raise CalledProcessError(process.returncode, command)
+
+    def trace(self):
+        """Return the trace in the Chrome trace event format"""
+
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+            steps = dict(self.steps)
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"steps": steps}}
+
+    def summary(self, count=10):
+        """Return the slowest steps as a text table"""
+
+        with self.lock:
+            steps = sorted(self.steps.items(),
+                           key=lambda item: item[1]["wall"], reverse=True)
+        mib = 1048576.0
+        lines = ["%-20s %9s %9s %9s %9s %9s" % ("step", "wall", "cpu",
+                                                "max rss", "written",
+                                                "received")]
+        for name, stats in steps[:count]:
+            lines.append("%-20s %8.1fs %8.1fs %6.0fMiB %6.0fMiB %6.0fMiB" %
+                         (name, stats["wall"], stats["cpu"],
+                          stats["max_rss"] / mib,
+                          stats["write_bytes"] / mib,
+                          stats["received"] / mib))
+        return "\n".join(lines)
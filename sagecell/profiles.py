@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""Build profiles: compiler flags of the Sage build and their benchmark"""
+
+from os import devnull
+from os.path import join
+from re import compile as re_compile
+from shutil import rmtree
+from subprocess import check_call
+from tempfile import mkdtemp
+from time import time
+
+# Instruction set extensions, which compilers and BLAS may use
+isa_pattern = re_compile(r"^(abm|adx|aes|asimd|avx|bmi|f16c|fma|gfni|movbe|"
+                         r"pclmulqdq|popcnt|sha|sse|ssse|sve|vaes|"
+                         r"vpclmulqdq)")
+flag_names = ("CFLAGS", "CXXFLAGS", "FCFLAGS")
+kernel = r"""
+#include <stdio.h>
+#define N 384
+static double a[N][N], b[N][N], c[N][N];
+int main(void)
+{
+    unsigned long long x = 1;
+    double sum = 0;
+    int i, j, k;
+    for (i = 0; i < N; i++)
+        for (j = 0; j < N; j++) {
+            a[i][j] = (i + j) % 7;
+            b[i][j] = (i * j) % 5;
+        }
+    /* Linear algebra */
+    for (i = 0; i < N; i++)
+        for (k = 0; k < N; k++)
+            for (j = 0; j < N; j++)
+                c[i][j] += a[i][k] * b[k][j];
+    for (i = 0; i < N; i++)
+        sum += c[i][i];
+    /* Number theory */
+    for (i = 0; i < 30000000; i++)
+        x = x * 48271 % 2147483647;
+    printf("%f %llu\n", sum, x);
+    return 0;
+}
+"""
+
+def cpu_flags():
+    """Return sorted instruction set extensions of the CPU"""
+
+    try:
+        with open("/proc/cpuinfo", 'r') as f:
+            for line in f:
+                key, colon, value = line.partition(':')
+                # "Features" on ARM
+                if key.strip() in ("flags", "Features"):
+                    return sorted(flag for flag in value.split()
+                                  if isa_pattern.match(flag))
+    except IOError:
+        pass
+    return []
+
+def missing_flags(flags):
+    """Return extensions of another CPU, which this CPU does not have"""
+
+    return sorted(set(flags) - set(cpu_flags()))
+
+def profile_environment(profile, lto=False):
+    """Return environment variables of the build profile
+
+    "profile" maps variable names to values. With "lto", compilers and
+    the linker get link-time optimization.
+    """
+
+    environment = dict(profile)
+    if lto:
+        for name in flag_names:
+            environment[name] = (environment.get(name, "-O2") +
+                                 " -flto").strip()
+        environment["LDFLAGS"] = (environment.get("LDFLAGS", "") +
+                                  " -flto").strip()
+    return environment
+
+def export_command(environment):
+    """Return a shell command exporting the variables"""
+
+    return "export %s" % " ".join('%s="%s"' % item
+                                  for item in sorted(environment.items()))
+
+def is_portable(environment):
+    """Check the build runs on any CPU of the architecture
+
+    Sage builds GMP, OpenBLAS and others for the build CPU, unless
+    SAGE_FAT_BINARY is set.
+    """
+
+    return (environment.get("SAGE_FAT_BINARY") == "yes" and
+            "-march=native" not in " ".join(environment.values()))
+
+def benchmark(cflags, repeat=3):
+    """Compile the kernel with the flags, return the best time in seconds"""
+
+    temp_path = mkdtemp(prefix="sagecell-profile-")
+    try:
+        source_path = join(temp_path, "kernel.c")
+        executable_path = join(temp_path, "kernel")
+        with open(source_path, 'w') as f:
+            f.write(kernel)
+        check_call(["cc"] + cflags.split() +
+                   ["-o", executable_path, source_path])
+        times = []
+        with open(devnull, 'w') as null:
+            for i in range(repeat):
+                start_time = time()
+                check_call([executable_path], stdout=null)
+                times.append(time() - start_time)
+    finally:
+        rmtree(temp_path)
+    return min(times)
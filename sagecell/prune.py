@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""Remove build-only files of the installed SageMathCell"""
+
+from os import killpg, listdir, lstat, remove, rename, setsid, walk
+from os.path import exists, isdir, islink, join, lexists
+from shutil import rmtree
+from signal import SIGTERM
+from socket import socket
+from stat import S_ISDIR
+from subprocess import CalledProcessError, check_output, Popen
+
+from .bench import post
+from .supervisor import wait_ready
+
+pruned_suffix = ".sagecell-pruned"
+failed_prefix = "sagecell-prune-failed:"
+# Print packages, which can not be imported
+import_check = ("import sys\n"
+                "for name in sys.argv[1:]:\n"
+                "    try:\n"
+                "        __import__(name)\n"
+                "    except BaseException:\n"
+                "        print('%s' + name)\n" % failed_prefix)
+service_code = "print(1 + 1)"
+
+def disk_usage(path):
+    """Return disk usage of the file or the tree in bytes
+
+    Hard links within the tree are counted once. Files linked from
+    outside the tree (e.g. packs of a git mirror) are not counted, their
+    removal frees nothing.
+    """
+
+    if not lexists(path):
+        return 0
+    if islink(path) or not isdir(path):
+        status = lstat(path)
+        if status.st_nlink > 1:
+            return 0
+        return status.st_blocks * 512
+    total = lstat(path).st_blocks * 512
+    links = {} # (device, inode) -> [links in the tree, all links, size]
+    for dir_path, dir_names, file_names in walk(path):
+        for name in dir_names + file_names:
+            status = lstat(join(dir_path, name))
+            if status.st_nlink > 1 and not S_ISDIR(status.st_mode):
+                key = (status.st_dev, status.st_ino)
+                entry = links.setdefault(key, [0, status.st_nlink,
+                                               status.st_blocks * 512])
+                entry[0] += 1
+                continue
+            total += status.st_blocks * 512
+    return total + sum(size for count, nlink, size in links.values()
+                       if count >= nlink)
+
+def shares_objects(path):
+    """Check the git objects of the checkout are shared with a mirror
+
+    A clone from a local mirror hard-links its packs (or uses
+    alternates), repacking them only adds a private copy.
+    """
+
+    objects_path = join(path, ".git", "objects")
+    if exists(join(objects_path, "info", "alternates")):
+        return True
+    for dir_path, dir_names, file_names in walk(objects_path):
+        for name in file_names:
+            if lstat(join(dir_path, name)).st_nlink > 1:
+                return True
+    return False
+
+def remove_paths(paths, dry_run=False):
+    """Remove the files and trees, return the reclaimed bytes
+
+    Files which can not be removed (e.g. installed by root) are kept.
+    """
+
+    reclaimed = 0
+    for path in paths:
+        before = disk_usage(path)
+        if dry_run:
+            reclaimed += before
+            continue
+        if isdir(path) and not islink(path):
+            rmtree(path, ignore_errors=True)
+        elif lexists(path):
+            try:
+                remove(path)
+            except OSError:
+                pass
+        reclaimed += before - disk_usage(path)
+    return reclaimed
+
+def test_dirs(site_packages_path, keep=()):
+    """Return {package: "tests" directories} except "keep" packages
+
+    Only importable packages (with __init__.py) are searched.
+    """
+
+    packages = {}
+    if not isdir(site_packages_path):
+        return packages
+    for name in sorted(listdir(site_packages_path)):
+        package_path = join(site_packages_path, name)
+        if (name in keep or islink(package_path) or
+                not exists(join(package_path, "__init__.py"))):
+            continue
+        for dir_path, dir_names, file_names in walk(package_path):
+            if "tests" in dir_names:
+                dir_names.remove("tests")
+                packages.setdefault(name, []).append(join(dir_path,
+                                                          "tests"))
+    return packages
+
+def failing_imports(python, names):
+    """Return names of the packages, which "python" can not import
+
+    "python" is a command list. All packages fail, if the check crashes.
+    """
+
+    if not names:
+        return set()
+    try:
+        output = check_output(python + ["-c", import_check] + list(names))
+    except (CalledProcessError, OSError):
+        return set(names)
+    return set(line[len(failed_prefix):].strip()
+               for line in output.decode("utf-8", "replace").splitlines()
+               if line.startswith(failed_prefix))
+
+def prune_tests(python, site_packages_path, keep=(), dry_run=False):
+    """Remove "tests" directories of packages, which import without them
+
+    Tests of every package are moved aside and the package is imported
+    by "python" (some packages import their tests in __init__). Tests of
+    failing packages are moved back. Return the reclaimed bytes.
+    """
+
+    packages = test_dirs(site_packages_path, keep)
+    if dry_run:
+        return sum(disk_usage(path) for paths in packages.values()
+                   for path in paths)
+    moved = {}
+    for name, paths in packages.items():
+        for path in paths:
+            try:
+                rename(path, path + pruned_suffix)
+            except OSError: # E.g. installed by root
+                continue
+            moved.setdefault(name, []).append(path)
+    failed = failing_imports(python, sorted(moved))
+    for name in failed:
+        for path in moved.pop(name):
+            rename(path + pruned_suffix, path)
+    return remove_paths([path + pruned_suffix for paths in moved.values()
+                         for path in paths])
+
+def compact_repository(run, path, dry_run=False):
+    """Drop the git history of the checkout except the current commit
+
+    Tags, remote branches and reflogs are removed, the current commit
+    becomes the shallow boundary and "git gc" repacks the rest. Later
+    updates fetch new commits from the git cache into the shallow
+    checkout. Checkouts sharing objects with the git cache are kept as
+    they are. Return the reclaimed bytes (the size of .git for
+    "dry_run").
+    """
+
+    git_path = join(path, ".git")
+    if shares_objects(path):
+        return 0
+    before = disk_usage(git_path)
+    if dry_run:
+        return before
+    run("cd %s; git for-each-ref --format='delete %%(refname)' refs/tags "
+        "refs/remotes | git update-ref --no-deref --stdin" % path)
+    run("cd %s; git rev-parse HEAD > .git/shallow" % path)
+    run("cd %s; git reflog expire --expire=now --all" % path)
+    run("cd %s; git gc --aggressive --prune=now --quiet" % path)
+    return before - disk_usage(git_path)
+
+def free_port():
+    """Return a free TCP port of localhost"""
+
+    sock = socket()
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+def serves(sagecell_path, timeout=300):
+    """Check the SageMathCell starts and computes by the /service endpoint
+
+    The server runs on a free port and is stopped after the check.
+    """
+
+    port = free_port()
+    url = "http://127.0.0.1:%s" % port
+    # Own process group for stopping the sage script with children
+    process = Popen("../sage/sage web_server.py -p %s" % port, shell=True,
+                    cwd=sagecell_path, preexec_fn=setsid)
+    try:
+        if not wait_ready(url + "/", process, timeout):
+            return False
+        try:
+            response = post(url + "/service", {"code": service_code,
+                                               "accepted_tos": "true"},
+                            timeout)
+        except Exception: # HTTP errors, timeout, not JSON
+            return False
+        return (response.get("success") is True and
+                response.get("stdout", "").strip() == "2")
+    finally:
+        if process.poll() is None:
+            killpg(process.pid, SIGTERM)
+        process.wait()
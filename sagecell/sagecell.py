@@ -2,30 +2,62 @@
 
 from argparse import ArgumentParser
 from errno import EACCES
-from multiprocessing import cpu_count
-from os import remove
-from os.path import dirname, exists, expanduser, isdir, isfile, join
+from json import dump, dumps
+from os import killpg, listdir, makedirs, setsid, strerror
+from os.path import (abspath, basename, dirname, exists, expanduser,
+                     getsize, isdir, isfile, join)
 from platform import platform
-from subprocess import check_output, CalledProcessError
-from sys import argv, exit
+from re import search
+from signal import signal, SIGTERM
+from subprocess import call, check_output, CalledProcessError, Popen
+from sys import argv, exit, stderr, stdin, stdout
+from time import time
 
-from configobj import ConfigObj
-
-try:
-    from fabric.api import local
-except ImportError:
-    print("Error: No module named 'fabric'. You can install it by typing:\n"
-          "    sudo pip install fabric\nor\n    su -c \"pip install fabric\"")
-    exit(1)
+from .gitcache import (checkout, mirror_head, mirror_path, submodule_mirrors,
+                       submodule_urls, update_mirror,
+                       update_submodule_mirrors)
+from .journal import Journal
+from .packages import PackagePlan
+from .scheduler import run_steps, Step, StepError
 
 module_location = dirname(__file__)
 config_sagecell_abs_path = join(module_location, "config/sagecell.ini")
-config = ConfigObj(config_sagecell_abs_path)
+config = None # Loaded by get_config()
 
 argparse = {} # Strings for -h --help
 messages = {} # Strings for output
 
-def auto():
+def add_supervise_arguments(parser):
+    """Add options of the "auto" and "supervise" subcommands"""
+
+    parser.add_argument("--cpus", metavar="LIST",
+            help=argparse["_parser_supervise_cpus"])
+    parser.add_argument("--cpu-weight", type=int,
+            help=argparse["_parser_supervise_cpu_weight"])
+    parser.add_argument("--memory-max", metavar="BYTES",
+            help=argparse["_parser_supervise_memory_max"])
+    parser.add_argument("-p", "--port", type=int,
+            help=argparse["_parser_start_port"])
+    parser.add_argument("-w", "--workers", type=int, default=1, metavar="N",
+            help=argparse["_parser_start_workers"])
+
+def as_root(distro, command):
+    """Return the command for running with a superuser (root) privileges"""
+
+    if distro == "debian":
+        return "su -c \"%s\"" % command.replace('"', '\\"')
+    return "sudo %s" % command
+
+def assets(args):
+    """Fingerprint and precompress static assets of the SageMathCell"""
+
+    static_path = expanduser("~/sc_build/sagecell/static")
+    if not isdir(static_path):
+        print(messages["_error_NoSageMathCell"])
+        exit(1)
+    optimize_static(static_path, args.brotli)
+
+def auto(args):
     """Start the SageMathCell automatically on boot"""
 
     # Check distro
@@ -47,16 +79,36 @@ def auto():
         else:
             print(messages["_error_UnknownValue"])
             exit(0)
-    # Update the Package Index
-    if distro == "ubuntu":
-        local("sudo apt-get update")
-    elif distro == "debian":
-        local("su -c \"apt-get update\"")
-    # Install screen
-    if distro == "ubuntu":
-        local("echo \"Y\" | sudo apt-get install screen")
-    elif distro == "debian":
-        local("su -c \"echo \"Y\" | apt-get install screen\"")
+    # Install required packages
+    for command in create_package_plan(distro, "auto").commands():
+        local(as_root(distro, command))
+    print(messages["_ask_username"].format("\n"))
+    answer = raw_input()
+    answer_lower = answer.lower()
+    username = answer_lower
+    # Supervisor restarts the SageMathCell after a crash
+    command = supervise_command(args)
+    if isdir("/run/systemd/system"):
+        from .supervisor import systemd_unit
+        unit_abs_path = "/etc/systemd/system/sagecell.service"
+        cpu_weight = (args.cpu_weight or
+                      int(get_config()["supervise_cpu_weight"]))
+        try:
+            with open(unit_abs_path, 'w') as f:
+                f.write(systemd_unit(username, command, args.cpus,
+                                     args.memory_max, cpu_weight))
+        except Exception as exception: # Python3 PermissionError
+            error_code = exception.errno
+            if error_code == EACCES: # 13
+                print(messages["_error_NoRoot"])
+                exit(1)
+            else:
+                print(messages["_error_Oops"] % strerror(error_code))
+                exit(1)
+        local(as_root(distro, "systemctl daemon-reload"))
+        local(as_root(distro, "systemctl enable sagecell.service"))
+        print(messages["_auto_systemd"] % unit_abs_path)
+        return
     # rc.local
     rc_local_abs_path = "/etc/rc.local"
     if exists(rc_local_abs_path) and isfile(rc_local_abs_path):
@@ -97,18 +149,12 @@ def auto():
             for line in rc_local_lines:
                 line_strip = line.strip()
                 if line_strip == "exit 0":
-                    print(messages["_ask_username"].format("\n"))
-                    answer = raw_input()
-                    answer_lower = answer.lower()
-                    username = answer_lower
                     if distro == "ubuntu":
-                        f.write("sudo -u %s screen -dmS sagecell "
-                                "/usr/local/bin/sagecellscript\n\n" %
-                                username)
+                        f.write("sudo -u %s %s > /dev/null 2>&1 &\n\n" %
+                                (username, " ".join(command)))
                     elif distro == "debian":
-                        f.write("su %s -c \"screen -dmS sagecell "
-                                "/usr/local/bin/sagecellscript\"\n\n" %
-                                username)
+                        f.write("su %s -c \"%s > /dev/null 2>&1 &\"\n\n" %
+                                (username, " ".join(command)))
                 f.write(line)
     except Exception as exception: # Python3 PermissionError
         error_code = exception.errno
@@ -119,6 +165,33 @@ def auto():
             print(messages["_error_Oops"] % strerror(error_code))
             exit(1)
 
+def bench(args):
+    """Benchmark a running SageMathCell server"""
+
+    # urllib2 is imported by this subcommand only
+    from .bench import format_report, run_benchmark
+
+    if args.file is not None:
+        # Snippets are separated by "---" lines
+        with open(args.file, 'r') as f:
+            snippets = [snippet.strip("\n") for snippet in
+                        ("\n" + f.read() + "\n").split("\n---\n")]
+        snippets = [snippet for snippet in snippets if snippet.strip()]
+    else:
+        snippets = [args.code or get_config()["bench_code"]]
+    results = run_benchmark(args.url, snippets, args.requests,
+                            args.concurrency, args.timeout,
+                            not args.no_kernel_probes)
+    print(format_report(results))
+    if args.json is not None:
+        if args.json == '-':
+            print(dumps(results, indent=2, separators=(',', ': '),
+                        sort_keys=True))
+        else:
+            with open(args.json, 'w') as f:
+                dump(results, f, indent=2, separators=(',', ': '),
+                     sort_keys=True)
+
 def check_distro():
     """Check linux distro"""
 
@@ -132,12 +205,126 @@ def check_distro():
         distro = "debian"
     return distro
 
+def create_bundle_steps(sc_build_path, bundle_path):
+    """Create the steps of an installation from a prebuilt bundle"""
+
+    from .build import usable_cpus
+    from .bundle import read_manifest, relocate, unpack, verify
+    from .profiles import missing_flags
+
+    sage_path = join(sc_build_path, "sage")
+    sagecell_path = join(sc_build_path, "sagecell")
+    manifest = {}
+
+    def unpack_bundle(run):
+        unpack(bundle_path, dirname(sc_build_path))
+        manifest.update(read_manifest(sc_build_path))
+        unpack_step.metrics = {"files": len(manifest["files"])}
+
+    def check_cpu(run):
+        # Sage built for the CPU needs its instruction set extensions
+        build = manifest.get("build")
+        if build is not None and not build["portable"]:
+            missing = missing_flags(build["cpu_flags"])
+            if missing:
+                raise ValueError("the bundle is built for CPUs with %s, "
+                                 "build it with --build-profile portable" %
+                                 ", ".join(missing))
+
+    def verify_bundle(run):
+        bad = verify(sc_build_path, manifest, usable_cpus())
+        if bad:
+            for rel_path in bad[:10]:
+                print(messages["_bundle_bad_file"] % rel_path)
+            raise ValueError("%s files differ from the manifest" % len(bad))
+
+    def relocate_bundle(run):
+        changed = relocate(sc_build_path, manifest)
+        print(messages["_bundle_relocated"] %
+              (changed, manifest["prefix"], sc_build_path))
+
+    unpack_step = Step("unpack", unpack_bundle)
+    return [unpack_step,
+            Step("check_cpu", check_cpu, requires=["unpack"]),
+            Step("verify", verify_bundle, requires=["check_cpu"]),
+            Step("relocate", relocate_bundle, requires=["verify"]),
+            # Sage relocates its binaries on the first start
+            Step("sage_location", ["cd %s; ./sage -c \"pass\"" % sage_path],
+                 requires=["relocate"]),
+            # Keep config.py of the bundle (e.g. written by sagecell tune)
+            Step("config",
+                 ["cd %s; test -f config.py || "
+                  "cp config_default.py config.py" % sagecell_path],
+                 requires=["relocate"])]
+
+def create_clone_steps(name, sc_build_path, args, requires=()):
+    """Create steps for updating the mirror and the checkout
+
+    "requires" are steps before the mirror update, e.g. the git install.
+    """
+
+    repository = get_config()["repositories"][name]
+    url = repository["url"]
+    branch = repository["branch"]
+    path = join(sc_build_path, name)
+    git_cache_path = expanduser(get_config()["git_cache"])
+    source = None
+    if args.git_source is not None:
+        source = join(expanduser(args.git_source), name)
+    submodules = {}
+    if args.offline:
+        submodules = submodule_mirrors(git_cache_path, url, branch)
+
+    def mirror(run):
+        if args.offline:
+            from .downloads import DownloadError
+            # Use the mirror as it is
+            if not isdir(mirror_path(git_cache_path, url)):
+                raise DownloadError("%s is not in the git cache" % url)
+            # Submodules come from their mirrors (see "sagecell prefetch")
+            missing = [submodule_url for submodule_url in
+                       submodule_urls(mirror_path(git_cache_path, url), url,
+                                      "refs/heads/%s" % branch)
+                       if submodule_url not in submodules]
+            if missing:
+                raise DownloadError("%s is not in the git cache" %
+                                    ", ".join(missing))
+            return
+        update_mirror(run, git_cache_path, url, source)
+
+    def clone(run):
+        checkout(run, mirror_path(git_cache_path, url), url, path, branch,
+                 submodules)
+
+    return [Step("mirror_%s" % name, mirror, requires=requires),
+            Step("clone_%s" % name, clone, requires=["mirror_%s" % name],
+                 inputs=lambda: {"branch": branch,
+                                 "mirror": mirror_head(git_cache_path, url,
+                                                       branch),
+                                 name: git_head(path)})]
+
+def create_download_cache(offline=False):
+    """Create the cache of downloaded installer scripts and packages"""
+
+    from .downloads import DownloadCache
+    return DownloadCache(expanduser(get_config()["download_cache"]),
+                         offline)
+
 def create_dictionaries():
     """Create "argparse" and "messages" dictionaries"""
 
-    config_argparse_rel_path = config["config_argparse_rel_path"]
+    try:
+        # Precompiled at package build time (see setup.py)
+        from .catalog import catalog_argparse, catalog_messages
+    except ImportError:
+        pass
+    else:
+        argparse.update(catalog_argparse)
+        messages.update(catalog_messages)
+        return
+    config_argparse_rel_path = get_config()["config_argparse_rel_path"]
     config_argparse_abs_path = join(module_location, config_argparse_rel_path)
-    config_messages_rel_path = config["config_messages_rel_path"]
+    config_messages_rel_path = get_config()["config_messages_rel_path"]
     config_messages_abs_path = join(module_location, config_messages_rel_path)
     with open(config_argparse_abs_path, 'r') as f:
         argparse_list = f.read().splitlines()
@@ -148,13 +335,338 @@ def create_dictionaries():
     for i in range(0, len(messages_list), 2):
         messages[messages_list[i]] = messages_list[i+1]
 
-def install():
-    """Install the SageMathCell"""
+def create_package_plan(distro, subcommand):
+    """Create a plan of the required apt packages for the subcommand"""
+
+    packages = get_config()["packages"]
+    plan = PackagePlan(update_ttl=int(get_config()["apt_update_ttl"]))
+    plan.add(packages.as_list(subcommand))
+    if distro in packages and subcommand in packages[distro]:
+        plan.add(packages[distro].as_list(subcommand))
+    return plan
+
+def create_install_steps(distro, sc_build_path, args):
+    """Create the installation steps graph"""
+
+    from .build import build_jobs, usable_cpus
+    from .profiles import (cpu_flags, export_command, is_portable,
+                           profile_environment)
 
-    sc_build_path = expanduser("~/sc_build")
     nodejs_alias_abs_path = "/usr/bin/node"
     sage_path = join(sc_build_path, "sage")
+    ipython_path = join(sc_build_path, "ipython")
+    sagecell_path = join(sc_build_path, "sagecell")
+    site_packages_path = join(sage_path, "local/lib/python/site-packages")
     sqlalchemy_path = join(sage_path, "local/lib/python2.7/sqlalchemy")
+    wheel_path = join(sage_path, "local/lib/python2.7/site-packages/wheel")
+    requirements_path = join(sc_build_path, "requirements.txt")
+    wheelhouse_path = expanduser(args.wheelhouse or
+                                 get_config()["wheelhouse"])
+    downloads = create_download_cache(args.offline)
+    urls = get_config()["downloads"]
+
+    def install_packages(run):
+        plan = create_package_plan(distro, "install")
+        if args.ccache:
+            plan.add(["ccache"])
+        # Check pip
+        if distro == "debian" and not pip_exists():
+            plan.add(["python-pip"])
+        if args.offline:
+            # Install from the apt archives cache
+            plan.update_ttl = float("inf")
+        # Update the Package Index (if outdated) and install all at once
+        for command in plan.commands():
+            run(as_root(distro, command))
+
+    def install_git(run):
+        # Install or update git
+        plan = PackagePlan(update_ttl=int(get_config()["apt_update_ttl"]))
+        plan.add(["git"], upgrade=True)
+        if args.offline:
+            plan.update_ttl = float("inf")
+        for command in plan.commands():
+            run(as_root(distro, command))
+
+    def install_pip(run):
+        # Install pip
+        if distro == "ubuntu" and not pip_exists():
+            run("sudo python %s" % downloads.fetch(run, urls["get_pip"]))
+
+    def install_npm(run):
+        if distro == "debian":
+            # Install node.js for npm installation
+            run(as_root(distro, "bash %s" %
+                        downloads.fetch(run, urls["nodesource"])))
+            plan = PackagePlan(["nodejs"], int(get_config()["apt_update_ttl"]))
+            for command in plan.commands():
+                run(as_root(distro, command))
+            run(as_root(distro, "sh %s" % downloads.fetch(run, urls["npm"])))
+        # Make an alias
+        if not exists(nodejs_alias_abs_path):
+            run(as_root(distro, "ln -s /usr/bin/nodejs %s" %
+                        nodejs_alias_abs_path))
+
+    def install_npm_packages(run):
+        # Tarballs of the registry, no network for the npm call itself
+        paths = [downloads.fetch(run, url) for url in npm_package_urls()]
+        run(as_root(distro, "npm install -g %s" % " ".join(paths)))
+
+    def requirements():
+        return ["%s==%s" % item
+                for item in get_config()["requirements"].items()]
+
+    def install_python_packages(run):
+        # Generate a requirements file with pinned versions
+        pinned = []
+        with open(requirements_path, 'w') as f:
+            for name, version in get_config()["requirements"].items():
+                # Check SQLAlchemy
+                if name == "SQLAlchemy" and exists(sqlalchemy_path):
+                    continue
+                f.write("%s==%s\n" % (name, version))
+                pinned.append((name, version))
+        if not exists(wheel_path):
+            pinned.append(("wheel", get_config()["wheel_version"]))
+        if args.offline:
+            from .downloads import DownloadError, missing_distributions
+            # Filled by "sagecell prefetch"
+            missing = missing_distributions(wheelhouse_path, pinned)
+            if missing:
+                raise DownloadError("%s is not in the wheelhouse" %
+                                    ", ".join("%s==%s" % item
+                                              for item in missing))
+        if not isdir(wheelhouse_path):
+            makedirs(wheelhouse_path)
+        # Build missing wheels only, install all by one pip call
+        if not exists(wheel_path):
+            run("cd %s; ./sage -pip install %s--find-links=%s wheel==%s" %
+                (sage_path, "--no-index " if args.offline else "",
+                 wheelhouse_path, get_config()["wheel_version"]))
+        run("cd %s; ./sage -pip wheel --no-deps --wheel-dir=%s "
+            "--find-links=%s %s-r %s" % (sage_path, wheelhouse_path,
+                                         wheelhouse_path,
+                                         "--no-index " if args.offline
+                                         else "",
+                                         requirements_path))
+        run("cd %s; %s" % (sage_path, as_root(distro,
+            "./sage -pip install --no-deps --upgrade --no-index "
+            "--find-links=%s -r %s" % (wheelhouse_path, requirements_path))))
+
+    def prune_installation(run):
+        from .prune import serves
+        prune_build(run, sc_build_path)
+        # Kernels start over ssh to localhost, "sagecell ssh" usually
+        # follows the installation
+        if call("ssh -o BatchMode=yes -o ConnectTimeout=10 localhost true",
+                shell=True) != 0:
+            print(messages["_error_prune_no_ssh"])
+        elif not serves(sagecell_path):
+            print(messages["_error_prune_unverified"])
+
+    def build_environment():
+        profile = {}
+        if args.build_profile is not None:
+            profile = get_config()["build_profiles"][args.build_profile]
+        return profile_environment(profile, args.lto)
+
+    def build_sage_inputs():
+        inputs = {"sage": git_head(sage_path)}
+        # Other flags need a rebuild
+        environment = build_environment()
+        if environment:
+            inputs.update(profile=args.build_profile, environment=environment)
+        return inputs
+
+    def build_sage(run):
+        # Choose the number of jobs by CPUs, load average and memory
+        memory_per_job = int(get_config()["build_memory_per_job"]) * 1024 ** 2
+        jobs = args.build_jobs or build_jobs(memory_per_job)
+        max_load = args.max_load or usable_cpus()
+        command = "make -j%s -l%s" % (jobs, max_load)
+        environment = build_environment()
+        if environment:
+            command = "%s; %s" % (export_command(environment), command)
+        if args.ccache:
+            command = ("export PATH=/usr/lib/ccache:$PATH CCACHE_DIR=%s; %s" %
+                       (expanduser(get_config()["ccache_dir"]), command))
+        print(messages["_build_jobs"] % (jobs, max_load))
+        run("cd %s; %s" % (sage_path, command))
+        # Recorded in the journal with the build time
+        build_sage_step.metrics.update(jobs=jobs, max_load=max_load,
+                                       ccache=args.ccache,
+                                       profile=args.build_profile,
+                                       portable=is_portable(environment),
+                                       cpu_flags=cpu_flags())
+
+    build_sage_step = Step("build_sage", build_sage,
+                           requires=["clone_sage", "packages"],
+                           inputs=build_sage_inputs)
+    steps = [
+        # Install npm, Sage dependencies and python-dev for psutil
+        Step("packages", install_packages, locks=["dpkg"]),
+        # get-pip.py is fetched by curl, sudo does not race apt prompts
+        Step("pip", install_pip, requires=["packages"]),
+        Step("npm", install_npm, requires=["packages"], locks=["dpkg"]),
+        # Install js: inherits, requirejs, coffee-script (-g -- globally)
+        Step("npm_packages", install_npm_packages, requires=["npm"],
+             inputs=lambda: {"packages": npm_package_urls()})]
+    # Get Sage, IPython and SageMathCell through the git mirror cache,
+    # clones overlap the apt transaction with a usable git
+    mirror_requires = []
+    if git_version() < (1, 8):
+        steps.append(Step("git", install_git, locks=["dpkg"]))
+        mirror_requires.append("git")
+    for name in get_config()["repositories"]:
+        steps += create_clone_steps(name, sc_build_path, args,
+                                    mirror_requires)
+    steps += [
+        # Build Sage
+        build_sage_step,
+        # Install threejs
+        Step("threejs",
+             ["cd %s; %s" % (sage_path,
+                             as_root(distro, "./sage -i threejs"))],
+             requires=["build_sage"], locks=["sage_local"],
+             inputs=lambda: {"sage": git_head(sage_path)}),
+        # We need IPython stuff, not present in spkg
+        Step("ipython",
+             ["cd %s; rm -rf IPython*" % site_packages_path,
+              "cd %s; rm -rf ipython*" % site_packages_path,
+              "cd %s; ../sage/sage setup.py develop" % ipython_path],
+             requires=["build_sage", "clone_ipython"], locks=["sage_local"],
+             inputs=lambda: {"sage": git_head(sage_path),
+                             "ipython": git_head(ipython_path)}),
+        # Install ecdsa, lockfile, paramiko, psutil, sockjs-tornado and
+        # SQLAlchemy
+        Step("python_packages", install_python_packages,
+             requires=["build_sage"], locks=["sage_local"],
+             inputs=lambda: {"sage": git_head(sage_path),
+                             "requirements": requirements()}),
+        # Build SageMathCell
+        Step("build_sagecell",
+             ["cd %s; ../sage/sage -sh -c \"make -B\"" % sagecell_path],
+             requires=["clone_sagecell", "npm_packages", "ipython",
+                       "python_packages"],
+             inputs=lambda: {"sage": git_head(sage_path),
+                             "ipython": git_head(ipython_path),
+                             "sagecell": git_head(sagecell_path),
+                             "requirements": requirements()}),
+        # Compile .pyc files now, not on the first requests
+        Step("warm", lambda run: warm_up(sc_build_path, prefetch=False),
+             requires=["build_sagecell"], locks=["sage_local"],
+             inputs=lambda: {"sage": git_head(sage_path),
+                             "ipython": git_head(ipython_path),
+                             "sagecell": git_head(sagecell_path),
+                             "requirements": requirements()}),
+        # Fingerprinted and precompressed copies of the built assets
+        Step("static_assets",
+             lambda run: optimize_static(join(sagecell_path, "static"),
+                                         args.brotli),
+             requires=["build_sagecell"],
+             inputs=lambda: {"sagecell": git_head(sagecell_path),
+                             "brotli": args.brotli}),
+        # Configuration, keep config.py written by sagecell tune
+        Step("config",
+             ["cd %s; test -f config.py || cp config_default.py config.py" %
+              sagecell_path],
+             requires=["clone_sagecell"],
+             inputs=lambda: {"sagecell": git_head(sagecell_path)})]
+    if args.prune:
+        steps.append(Step("prune", prune_installation,
+                          requires=["threejs", "warm", "static_assets",
+                                    "config"]))
+    return steps
+
+def deploy(args):
+    """Roll out the SageMathCell to many hosts"""
+
+    from .deploy import deploy as deploy_hosts
+    from .deploy import DryRunTransport, format_summary, read_hosts
+    from .deploy import transports
+
+    hosts = read_hosts(args.hosts)
+    if not hosts:
+        print(messages["_error_NoHosts"] % args.hosts)
+        exit(1)
+    if args.bundle is not None and not isfile(args.bundle):
+        print(messages["_error_NoBundle"] % args.bundle)
+        exit(1)
+    restart_command = None
+    if args.restart:
+        restart_command = (args.restart_command or
+                           get_config()["deploy_restart_command"])
+    # Output of every host goes to its own log
+    log_path = expanduser(get_config()["deploy_logs"])
+    if not isdir(log_path):
+        makedirs(log_path)
+    transport_factory = transports[args.transport]
+    if transport_factory is DryRunTransport:
+
+        def transport_factory(host, log):
+            # Texts of the dry run come from the messages catalog
+            return DryRunTransport(host, log, messages)
+
+    start_time = time()
+    try:
+        results = deploy_hosts(hosts, transport_factory, log_path,
+                               args.bundle and abspath(args.bundle),
+                               args.install, restart_command,
+                               args.port or 8888, args.jobs, args.bwlimit,
+                               args.min_healthy, args.ready_timeout)
+    except ValueError as error:
+        print(messages["_error_Oops"] % error)
+        exit(1)
+    print(format_summary(hosts, results))
+    print(messages["_deployed"] %
+          (sum(1 for result in results.values()
+               if result["status"] == "ok"),
+           len(hosts), time() - start_time, log_path))
+    if any(result["status"] != "ok" for result in results.values()):
+        exit(1)
+
+def get_config():
+    """Load the "config/sagecell.ini" file on first use"""
+
+    global config
+    if config is None:
+        from configobj import ConfigObj
+        config = ConfigObj(config_sagecell_abs_path)
+    return config
+
+def git_head(path):
+    """Return the commit SHA of the git checkout or None"""
+
+    if not isdir(join(path, ".git")):
+        return None
+    try:
+        sha = check_output("cd %s; git rev-parse HEAD" % path, shell=True)
+    except CalledProcessError:
+        return None
+    return sha.strip()
+
+def git_version():
+    """Return (major, minor) version of git, (0, 0) without git"""
+
+    try:
+        output = check_output("git --version", shell=True)
+    except (CalledProcessError, OSError):
+        return (0, 0)
+    # E.g. "git version 2.39.5"
+    match = search(r"(\d+)\.(\d+)", output.decode("utf-8", "replace"))
+    if match is None:
+        return (0, 0)
+    return tuple(int(number) for number in match.groups())
+
+def install(args):
+    """Install the SageMathCell"""
+
+    sc_build_path = expanduser("~/sc_build")
+    journal_path = join(sc_build_path, "journal.json")
+    if (args.build_profile is not None and
+            args.build_profile not in get_config()["build_profiles"]):
+        print(messages["_error_NoProfile"] % args.build_profile)
+        exit(1)
 
     # Check distro
     distro = check_distro()
@@ -175,82 +687,55 @@ def install():
         else:
             print(messages["_error_UnknownValue"])
             exit(0)
-    # Check Internet access
-    print(messages["_ask_internet"])
-    try:
-        answer = raw_input()
-    except EOFError:
-        answer = 'y'
-    answer_lower = answer.lower()
-    if ((answer_lower == 'n') or (answer_lower == "no") or
-            (answer_lower == "nix")):
-        print(messages["_error_Internet"])
-        exit(0)
-    # Update the Package Index
-    if distro == "ubuntu":
-        local("sudo apt-get update")
-    elif distro == "debian":
-        local("su -c \"apt-get update\"")
-    # Check git version
-    try:
-        git_version = check_output("git --version", shell=True)
-    except CalledProcessError:
-        # Install git
-        if distro == "ubuntu":
-            local("echo \"Y\" | sudo apt-get install git")
-        elif distro == "debian":
-            local("su -c \"echo \"Y\" | apt-get install git\"")
-        git_version = check_output("git --version", shell=True)
-    git_version = git_version.replace("git version ", "").replace("\n", "")
-    git_version_float = float(git_version[:3])
-    if git_version_float < 1.8:
-        # Update git
-        if distro == "ubuntu":
-            local("echo \"Y\" | sudo apt-get install git")
-        elif distro == "debian":
-            local("su -c \"echo \"Y\" | apt-get install git\"")
-    # Check pip
-    try:
-        pip_version = check_output("pip --version", shell=True)
-    except CalledProcessError:
-        # Install pip
-        if distro == "ubuntu":
-            downloads_path = expanduser("~/Downloads")
-            local("cd %s; wget https://bootstrap.pypa.io/get-pip.py" %
-                    downloads_path)
-            local("cd %s; sudo python get-pip.py" % downloads_path)
-            pip_path = join(downloads_path, "get-pip.py")
-            if exists(pip_path) and isfile(pip_path):
-                remove(pip_path)
-        elif distro == "debian":
-            # Install python-dev for pip installation
-            local("su -c \"echo \"Y\" | apt-get install python-dev\"")
-            local("su -c \"echo \"Y\" | apt-get install python-pip\"")
-    # Install npm
-    if distro == "ubuntu":
-        local("echo \"Y\" | sudo apt-get install npm")
-    elif distro == "debian":
-        # Install curl for node.js, npm installations
-        local("su -c \"echo \"Y\" | apt-get install curl\"")
-        # Install node.js for npm installation
-        local("su -c \"curl --silent --location "
-              "https://deb.nodesource.com/setup_0.12 | bash -\"")
-        local("su -c \"echo \"Y\" | apt-get install --yes nodejs\"")
-        local("su -c \"curl https://www.npmjs.com/install.sh | sh\"")
-    # Make an alias
-    if not exists(nodejs_alias_abs_path):
-        if distro == "ubuntu":
-            local("sudo ln -s /usr/bin/nodejs %s" % nodejs_alias_abs_path)
-        elif distro == "debian":
-            local("su -c \"ln -s /usr/bin/nodejs %s\"" % nodejs_alias_abs_path)
-    # Install js: inherits, requirejs, coffee-script (-g -- globally)
-    if distro == "ubuntu":
-        local("sudo npm install -g inherits requirejs coffee-script")
-    elif distro == "debian":
-        local("su -c \"npm install -g inherits requirejs coffee-script\"")
+    # Check Internet access, a bundle is installed from the local file
+    if args.from_bundle is not None:
+        if not isfile(args.from_bundle):
+            print(messages["_error_NoBundle"] % args.from_bundle)
+            exit(1)
+        args.resume = False
+    elif not args.offline:
+        print(messages["_ask_internet"])
+        try:
+            answer = raw_input()
+        except EOFError:
+            answer = 'y'
+        answer_lower = answer.lower()
+        if ((answer_lower == 'n') or (answer_lower == "no") or
+                (answer_lower == "nix")):
+            print(messages["_error_Internet"])
+            exit(0)
     # Create a directory for all components
-    if exists(sc_build_path):
-        if isdir(sc_build_path):
+    if args.resume and isdir(sc_build_path):
+        # Continue from the first not completed step
+        pass
+    elif exists(sc_build_path):
+        if isdir(sc_build_path) and args.from_bundle is None:
+            # Update git checkouts in place, remove files of the installer
+            repositories = get_config()["repositories"]
+            kept = []
+            for name in sorted(listdir(sc_build_path)):
+                path = join(sc_build_path, name)
+                if name in repositories and isdir(join(path, ".git")):
+                    kept.append(name)
+                    continue
+                if name not in ("journal.json", "requirements.txt"):
+                    # Not created by the installer, e.g. a user backup
+                    kind = "dir" if isdir(path) else "file"
+                    rel_path = join("sc_build", name)
+                    print(messages["_ask_replace"] % (rel_path, kind))
+                    try:
+                        answer = raw_input()
+                    except EOFError:
+                        answer = 'y'
+                    answer_lower = answer.lower()
+                    if ((answer_lower != 'y') and (answer_lower != "yes") and
+                            (answer_lower != "yep")):
+                        print(messages["_error_replace"] % (rel_path, kind))
+                        exit(0)
+                local(as_root(distro, "rm -r %s" % path))
+            if kept:
+                print(messages["_update_checkouts"] % ", ".join(kept))
+        elif isdir(sc_build_path):
             print(messages["_ask_replace"] % ("sc_build", "dir"))
             try:
                 answer = raw_input()
@@ -259,10 +744,7 @@ def install():
             answer_lower = answer.lower()
             if ((answer_lower == 'y') or (answer_lower == "yes") or
                     (answer_lower == "yep")):
-                if distro == "ubuntu":
-                    local("sudo rm -r %s" % sc_build_path)
-                elif distro == "debian":
-                    local("su -c \"rm -r %s\"" % sc_build_path)
+                local(as_root(distro, "rm -r %s" % sc_build_path))
             else:
                 print(messages["_error_replace"] % ("sc_build", "dir"))
                 exit(0)
@@ -275,102 +757,356 @@ def install():
             answer_lower = answer.lower()
             if ((answer_lower == 'y') or (answer_lower == "yes") or
                     (answer_lower == "yep")):
-                if distro == "ubuntu":
-                    local("sudo rm %s" % sc_build_path)
-                elif distro == "debian":
-                    local("su -c \"rm %s\"" % sc_build_path)
+                local(as_root(distro, "rm %s" % sc_build_path))
             else:
                 print(messages["_error_replace"] % ("sc_build", "file"))
                 exit(0)
-    local("mkdir %s" % sc_build_path)
-    # Get Sage
-    local("cd %s; git clone https://github.com/novoselt/sage.git" %
-            sc_build_path)
-    local("cd %s; git checkout sagecell" % sage_path)
-    local("cd %s; git submodule update --init --recursive" % sage_path)
-    # Install Sage dependencies
-    if distro == "ubuntu":
-        local("echo \"Y\" | sudo apt-get install gcc m4 make perl tar")
-    elif distro == "debian":
-        local("su -c \"echo \"Y\" | apt-get install gcc m4 make perl tar\"")
-    # Find out the number of CPUs in the system and build Sage
+    if args.from_bundle is not None:
+        # Unpack, verify and relocate instead of the build
+        steps = create_bundle_steps(sc_build_path,
+                                    abspath(args.from_bundle))
+        journal = None
+    else:
+        if not exists(sc_build_path):
+            local("mkdir %s" % sc_build_path)
+        # Run independent steps in parallel, record completed steps
+        steps = create_install_steps(distro, sc_build_path, args)
+        journal = Journal(journal_path)
+    runner = local
+    profiler = None
+    if args.profile is not None:
+        from .profiler import Profiler
+        # Command output goes to the log instead of the terminal
+        log_path = expanduser(get_config()["install_log"])
+        if not isdir(dirname(log_path)):
+            makedirs(dirname(log_path))
+
+        def report(name, stats):
+            print(messages["_step_done"] % (name, stats["wall"]))
+
+        profiler = Profiler(log_path,
+                            int(get_config()["install_log_size"]) * 1048576,
+                            report=report)
+        runner = profiler
+        print(messages["_install_log"] % log_path)
     try:
-        cpu_quantity = cpu_count()
-    except NotImplementedError:
-        cpu_quantity = 1
-    local("cd %s; make -j%s" % (sage_path, str(cpu_quantity)))
-    # Install threejs
-    if distro == "ubuntu":
-        local("cd %s; sudo ./sage -i threejs" % sage_path)
-    elif distro == "debian":
-        local("cd %s; su -c \"./sage -i threejs\"" % sage_path)
-    # We need IPython stuff, not present in spkg
-    local("cd %s; rm -rf IPython*" % join(sage_path,
-            "local/lib/python/site-packages"))
-    local("cd %s; rm -rf ipython*" % join(sage_path,
-            "local/lib/python/site-packages"))
-    local("cd %s; git clone https://github.com/novoselt/ipython.git" %
-            sc_build_path)
-    local("cd %s; git checkout sagecell" % join(sc_build_path, "ipython"))
-    local("cd %s; git submodule update --init --recursive" %
-            join(sc_build_path, "ipython"))
-    local("cd %s; ../sage/sage setup.py develop" % join(sc_build_path,
-                                                        "ipython"))
-    # Install python-dev for psutil installation
-    if distro == "ubuntu":
-        local("echo \"Y\" | sudo apt-get install python-dev")
-    elif distro == "debian":
-        local("su -c \"echo \"Y\" | apt-get install python-dev\"")
-    # Install ecdsa, lockfile, paramiko, psutil, sockjs-tornado
-    if distro == "ubuntu":
-        local("cd %s; sudo ./sage -pip install --no-deps --upgrade "
-              "ecdsa" % sage_path)
-        local("cd %s; sudo ./sage -pip install --no-deps --upgrade "
-              "lockfile" % sage_path)
-        local("cd %s; sudo ./sage -pip install --no-deps --upgrade "
-              "paramiko" % sage_path)
-        local("cd %s; sudo ./sage -pip install --no-deps --upgrade "
-              "psutil" % sage_path)
-        local("cd %s; sudo ./sage -pip install --no-deps --upgrade "
-              "sockjs-tornado" % sage_path)
-    elif distro == "debian":
-        local("cd %s; su -c \"./sage -pip install "
-              "--no-deps --upgrade ecdsa\"" % sage_path)
-        local("cd %s; su -c \"./sage -pip install "
-              "--no-deps --upgrade lockfile\"" % sage_path)
-        local("cd %s; su -c \"./sage -pip install "
-              "--no-deps --upgrade paramiko\"" % sage_path)
-        local("cd %s; su -c \"./sage -pip install "
-              "--no-deps --upgrade psutil\"" % sage_path)
-        local("cd %s; su -c \"./sage -pip install "
-              "--no-deps --upgrade sockjs-tornado\"" % sage_path)
-    # Build SageMathCell
-    local("cd %s; git clone https://github.com/sagemath/sagecell.git" %
-            sc_build_path)
-    local("cd %s; git submodule update --init --recursive" %
-            join(sc_build_path, "sagecell"))
-    local("cd %s; ../sage/sage -sh -c \"make -B\"" % join(sc_build_path,
-                                                          "sagecell"))
-    # Configuration
-    local("cd %s; cp config_default.py config.py" % join(sc_build_path,
-                                                         "sagecell"))
-    # Check SQLAlchemy
-    if not exists(sqlalchemy_path):
-        # Install SQLAlchemy
-        if distro == "ubuntu":
-            local("cd %s; sudo ./sage -pip install --no-deps --upgrade "
-                  "SQLAlchemy" % sage_path)
-        elif distro == "debian":
-            local("cd %s; su -c \"./sage -pip install "
-                  "--no-deps --upgrade SQLAlchemy\"" % sage_path)
+        skipped = run_steps(steps, runner,
+                            args.jobs or int(get_config()["install_jobs"]),
+                            journal, profiler)
+    except StepError as error:
+        # Commands print their errors, but not missing or broken files
+        if isinstance(error.exception, (EnvironmentError, ValueError)):
+            print(messages["_error_Oops"] % error.exception)
+        print(messages["_error_step"] % error.step.name)
+        if journal is not None:
+            print(messages["_resume"])
+        exit(1)
+    finally:
+        if profiler is not None:
+            with open(args.profile, 'w') as f:
+                dump(profiler.trace(), f, separators=(',', ':'))
+            profiler.close()
+            print(profiler.summary())
+            print(messages["_profile_written"] % args.profile)
+    if skipped:
+        print(messages["_skipped"] % ", ".join(skipped))
     print(messages["_installed"])
 
+def links(args):
+    """Export, import or merge permalinks of the SageMathCell database"""
+
+    from gzip import GzipFile
+    from sqlite3 import DatabaseError
+    from .links import (connect, export_rows, import_rows, read_lines,
+                        write_lines)
+
+    config = get_config()
+    db_path = expanduser(args.db or config["links_db"])
+    batch_size = int(config["links_batch"])
+    # sqlite creates missing databases
+    source_path = None
+    if args.links_action == "export":
+        source_path = db_path
+    elif args.links_action == "merge":
+        source_path = expanduser(args.source)
+    if source_path is not None and not isfile(source_path):
+        print(messages["_error_NoDatabase"] % source_path)
+        exit(1)
+    start_time = time()
+    try:
+        if args.links_action == "export":
+            since = args.since
+            if since is None and args.state and isfile(args.state):
+                with open(args.state, 'r') as f:
+                    since = f.read().strip() or None
+            items = export_rows(connect(db_path), config["links_table"],
+                                config["links_watermark"], since,
+                                batch_size)
+            trailer = {}
+
+            def counted(items):
+                for item in items:
+                    if isinstance(item, dict):
+                        trailer.update(item)
+                    yield item
+
+            if args.output == '-':
+                # Bytes of stdout on Python 3
+                write_lines(counted(items), getattr(stdout, "buffer", stdout))
+            else:
+                # Compressed by the file name
+                opener = GzipFile if args.output.endswith(".gz") else open
+                with opener(args.output, 'wb') as f:
+                    write_lines(counted(items), f)
+            if args.state and trailer.get("watermark") is not None:
+                with open(args.state, 'w') as f:
+                    f.write("%s\n" % trailer["watermark"])
+            rows = trailer["rows"]
+        else:
+            if args.links_action == "merge":
+                # Rows of another database, existing links are kept
+                source = connect(source_path)
+                items = export_rows(source, config["links_table"],
+                                    config["links_watermark"],
+                                    batch_size=batch_size)
+                update = False
+            elif args.input == '-':
+                items = read_lines(getattr(stdin, "buffer", stdin))
+                update = not args.keep_existing
+            else:
+                opener = GzipFile if args.input.endswith(".gz") else open
+                items = read_lines(opener(args.input, 'rb'))
+                update = not args.keep_existing
+            counts = import_rows(connect(db_path), items, update,
+                                 batch_size)
+            stderr.write(messages["_links_imported"] %
+                         (counts["inserted"], counts["updated"]) + "\n")
+            rows = counts["rows"]
+    except (ValueError, IOError, DatabaseError) as error:
+        print(messages["_error_Oops"] % error)
+        exit(1)
+    duration = time() - start_time
+    # Export data may go to stdout
+    stderr.write(messages["_links_rows"] %
+                 (rows, duration, rows / duration if duration else 0) +
+                 "\n")
+
+def local(command):
+    """Run the command on the local machine by fabric"""
+
+    # Import on first use: fabric (paramiko, crypto) is slow to import
+    try:
+        from fabric.api import local as fabric_local
+    except ImportError:
+        print("Error: No module named 'fabric'. You can install it by "
+              "typing:\n    sudo pip install fabric\nor\n    su -c \"pip "
+              "install fabric\"")
+        exit(1)
+    return fabric_local(command)
+
 def main():
     """Main function"""
 
     create_dictionaries()
     args = parse_command_line_args()
-    args.function_name()
+    args.function_name(args)
+
+def npm_package_urls():
+    """Return registry URLs of the pinned npm packages"""
+
+    return [get_config()["npm_registry"].format(name=name, version=version)
+            for name, version in get_config()["npm_packages"].items()]
+
+def optimize_static(static_path, brotli):
+    """Optimize static assets, print their sizes"""
+
+    from .assets import brotli_available, optimize_assets
+    from .build import usable_cpus
+
+    if brotli and not brotli_available():
+        print(messages["_error_brotli"])
+        brotli = False
+    manifest = optimize_assets(static_path, brotli, usable_cpus())
+    size = sum(entry["size"] for entry in manifest.values())
+    gzip_size = sum(entry.get("gzip_size", entry["size"])
+                    for entry in manifest.values())
+    print(messages["_assets"] % (len(manifest), size / 1048576.0,
+                                 gzip_size / 1048576.0))
+
+def pip_exists():
+    """Check pip"""
+
+    try:
+        check_output("pip --version", shell=True)
+    except CalledProcessError:
+        return False
+    return True
+
+def pack(args):
+    """Pack the installed SageMathCell into a relocatable bundle"""
+
+    from .build import usable_cpus
+    from .bundle import pack as pack_bundle
+
+    sc_build_path = expanduser("~/sc_build")
+    if not isdir(join(sc_build_path, "sagecell")):
+        print(messages["_error_NoSageMathCell"])
+        exit(1)
+    bundle_path = args.output
+    if bundle_path is None:
+        # zstd decompresses faster, xz is available everywhere
+        if call("command -v zstd > /dev/null", shell=True) == 0:
+            bundle_path = "sagecell-bundle.tar.zst"
+        else:
+            bundle_path = "sagecell-bundle.tar.xz"
+    if not bundle_path.endswith((".tar.zst", ".tar.xz")):
+        print(messages["_error_bundle_format"])
+        exit(1)
+    # Record the build profile for checking CPUs of target hosts
+    extra = {}
+    entry = Journal(join(sc_build_path, "journal.json")).get("build_sage")
+    if entry is not None and "cpu_flags" in entry:
+        extra["build"] = {"profile": entry["profile"],
+                          "portable": entry["portable"],
+                          "cpu_flags": entry["cpu_flags"]}
+    start_time = time()
+    manifest = pack_bundle(sc_build_path, abspath(bundle_path),
+                           get_config().as_list("bundle_exclude"),
+                           usable_cpus(), extra)
+    print(messages["_packed"] % (bundle_path, len(manifest["files"]),
+                                 getsize(bundle_path) / 1048576.0,
+                                 time() - start_time))
+    if not extra.get("build", {"portable": True})["portable"]:
+        print(messages["_packed_native"])
+
+def prefetch(args):
+    """Fill the download, wheel and git caches for offline installations"""
+
+    downloads = create_download_cache()
+    git_cache_path = expanduser(get_config()["git_cache"])
+    steps = []
+
+    def fetch_step(name, url):
+        return Step("fetch %s" % name,
+                    lambda run: downloads.fetch(run, url))
+
+    def mirror_step(name, url, branch):
+        def mirror(run):
+            update_mirror(run, git_cache_path, url)
+            # E.g. static components of IPython
+            update_submodule_mirrors(run, git_cache_path, url, branch)
+        return Step("mirror %s" % name, mirror)
+
+    for name, url in get_config()["downloads"].items():
+        steps.append(fetch_step(name, url))
+    for url in npm_package_urls():
+        steps.append(fetch_step(basename(url), url))
+    # Source archives of the pinned Python packages, Sage builds wheels
+    # of them
+    wheelhouse_path = expanduser(get_config()["wheelhouse"])
+    requirements = ["%s==%s" % item
+                    for item in get_config()["requirements"].items()]
+    requirements.append("wheel==%s" % get_config()["wheel_version"])
+    steps.append(Step("fetch wheelhouse",
+                      ["mkdir -p %s" % wheelhouse_path,
+                       "python -m pip download --no-deps --no-binary :all: "
+                       "-d %s %s" % (wheelhouse_path,
+                                     " ".join(requirements))]))
+    if not args.downloads_only:
+        for name, repository in get_config()["repositories"].items():
+            steps.append(mirror_step(name, repository["url"],
+                                     repository["branch"]))
+    try:
+        run_steps(steps, local, args.jobs)
+    except StepError as error:
+        print(messages["_error_step"] % error.step.name)
+        exit(1)
+    print(messages["_prefetched"] % (len(downloads.index), downloads.path))
+
+def profiles(args):
+    """List build profiles, compare them by a benchmark"""
+
+    from .profiles import benchmark, cpu_flags, export_command
+
+    build_profiles = get_config()["build_profiles"]
+    print(messages["_cpu_flags"] % " ".join(cpu_flags()))
+    for name in build_profiles:
+        print(messages["_build_profile"] %
+              (name, export_command(build_profiles[name])))
+    if not args.benchmark:
+        return
+    if call("command -v cc > /dev/null", shell=True) != 0:
+        print(messages["_error_NoCompiler"])
+        exit(1)
+
+    def timed(cflags):
+        try:
+            return benchmark(cflags)
+        except (OSError, CalledProcessError):
+            print(messages["_error_benchmark"] % cflags)
+            exit(1)
+
+    # Sage compiles with -O2 by default
+    default_time = timed("-O2")
+    print(messages["_benchmark_profile"] % ("default", default_time, 1.0))
+    for name in build_profiles:
+        cflags = build_profiles[name].get("CFLAGS", "-O2")
+        profile_time = timed(cflags)
+        print(messages["_benchmark_profile"] %
+              (name, profile_time, default_time / profile_time))
+
+def prune(args):
+    """Remove build-only files of the installed SageMathCell"""
+
+    from .prune import serves
+
+    sc_build_path = expanduser("~/sc_build")
+    if not isdir(join(sc_build_path, "sagecell")):
+        print(messages["_error_NoSageMathCell"])
+        exit(1)
+    start_time = time()
+    reclaimed = prune_build(local, sc_build_path, args.dry_run)
+    print(messages["_pruned_total"] %
+          (sum(size for category, size in reclaimed) / 1048576.0,
+           time() - start_time))
+    if args.dry_run:
+        print(messages["_prune_dry_run"])
+        return
+    if args.no_verify:
+        return
+    print(messages["_prune_verifying"])
+    if not serves(join(sc_build_path, "sagecell")):
+        print(messages["_error_prune_verify"])
+        exit(1)
+    print(messages["_prune_verified"])
+
+def prune_build(run, sc_build_path, dry_run=False):
+    """Remove build-only files, return reclaimed bytes by category"""
+
+    from .prune import compact_repository, prune_tests, remove_paths
+
+    sage_path = join(sc_build_path, "sage")
+    repositories = [join(sc_build_path, name)
+                    for name in get_config()["repositories"]
+                    if isdir(join(sc_build_path, name, ".git"))]
+    site_packages_path = join(sage_path, "local/lib/python2.7/site-packages")
+    reclaimed = [
+        # Source tarballs of Sage packages
+        ("upstream", remove_paths([join(sage_path, "upstream")], dry_run)),
+        # Build directories of Sage packages and the Sage library
+        ("build", remove_paths([join(sage_path, "local/var/tmp/sage/build"),
+                                join(sage_path, "src/build")], dry_run)),
+        ("git", sum(compact_repository(run, path, dry_run)
+                    for path in repositories)),
+        # Test suites of third-party Python packages, which import
+        # without them
+        ("tests", prune_tests([join(sage_path, "sage"), "-python"],
+                              site_packages_path,
+                              get_config().as_list("prune_keep_tests"),
+                              dry_run))]
+    for category, size in reclaimed:
+        print(messages["_pruned"] % (category, size / 1048576.0))
+    return reclaimed
 
 def parse_command_line_args():
     """Parse command line arguments"""
@@ -386,65 +1122,394 @@ def parse_command_line_args():
     parser_install = subparsers.add_parser("install",
             description=argparse["_parser_install"],
             help=argparse["_parser_install"])
+    parser_install.add_argument("--brotli", action="store_true",
+            help=argparse["_parser_assets_brotli"])
+    parser_install.add_argument("--build-jobs", type=int, metavar="N",
+            help=argparse["_parser_install_build_jobs"])
+    parser_install.add_argument("--build-profile", metavar="NAME",
+            help=argparse["_parser_install_build_profile"])
+    parser_install.add_argument("--ccache", action="store_true",
+            help=argparse["_parser_install_ccache"])
+    parser_install.add_argument("--from-bundle", metavar="FILE",
+            help=argparse["_parser_install_from_bundle"])
+    parser_install.add_argument("--git-source", metavar="PATH",
+            help=argparse["_parser_install_git_source"])
+    parser_install.add_argument("-j", "--jobs", type=int,
+            help=argparse["_parser_install_jobs"])
+    parser_install.add_argument("--lto", action="store_true",
+            help=argparse["_parser_install_lto"])
+    parser_install.add_argument("--max-load", type=float, metavar="LOAD",
+            help=argparse["_parser_install_max_load"])
+    parser_install.add_argument("--offline", action="store_true",
+            help=argparse["_parser_install_offline"])
+    parser_install.add_argument("--profile", metavar="TRACE_FILE",
+            help=argparse["_parser_install_profile"])
+    parser_install.add_argument("--prune", action="store_true",
+            help=argparse["_parser_install_prune"])
+    parser_install.add_argument("--resume", action="store_true",
+            help=argparse["_parser_install_resume"])
+    parser_install.add_argument("--wheelhouse", metavar="PATH",
+            help=argparse["_parser_install_wheelhouse"])
     parser_install.set_defaults(function_name=install)
     # Create the parser for the "start" subcommand
     parser_list = subparsers.add_parser("start",
             description=argparse["_parser_start"],
             help=argparse["_parser_start"])
+    parser_list.add_argument("-p", "--port", type=int,
+            help=argparse["_parser_start_port"])
+    parser_list.add_argument("--warm", action="store_true",
+            help=argparse["_parser_start_warm"])
+    parser_list.add_argument("-w", "--workers", type=int, default=1,
+            metavar="N", help=argparse["_parser_start_workers"])
     parser_list.set_defaults(function_name=start)
+    # Create the parser for the "assets" subcommand
+    parser_list = subparsers.add_parser("assets",
+            description=argparse["_parser_assets"],
+            help=argparse["_parser_assets"])
+    parser_list.add_argument("--brotli", action="store_true",
+            help=argparse["_parser_assets_brotli"])
+    parser_list.set_defaults(function_name=assets)
+    # Create the parser for the "bench" subcommand
+    parser_list = subparsers.add_parser("bench",
+            description=argparse["_parser_bench"],
+            help=argparse["_parser_bench"])
+    parser_list.add_argument("-c", "--concurrency", type=int, default=10,
+            metavar="N", help=argparse["_parser_bench_concurrency"])
+    parser_list.add_argument("--code",
+            help=argparse["_parser_bench_code"])
+    parser_list.add_argument("--file", metavar="PATH",
+            help=argparse["_parser_bench_file"])
+    parser_list.add_argument("--json", metavar="PATH",
+            help=argparse["_parser_bench_json"])
+    parser_list.add_argument("-n", "--requests", type=int, default=100,
+            metavar="N", help=argparse["_parser_bench_requests"])
+    parser_list.add_argument("--no-kernel-probes", action="store_true",
+            help=argparse["_parser_bench_no_kernel_probes"])
+    parser_list.add_argument("--timeout", type=float, default=60,
+            metavar="SECONDS", help=argparse["_parser_bench_timeout"])
+    parser_list.add_argument("--url", default="http://localhost:8888",
+            help=argparse["_parser_bench_url"])
+    parser_list.set_defaults(function_name=bench)
+    # Create the parser for the "supervise" subcommand
+    parser_list = subparsers.add_parser("supervise",
+            description=argparse["_parser_supervise"],
+            help=argparse["_parser_supervise"])
+    add_supervise_arguments(parser_list)
+    parser_list.set_defaults(function_name=supervise)
+    # Create the parser for the "tune" subcommand
+    parser_list = subparsers.add_parser("tune",
+            description=argparse["_parser_tune"],
+            help=argparse["_parser_tune"])
+    parser_list.add_argument("--dry-run", action="store_true",
+            help=argparse["_parser_tune_dry_run"])
+    parser_list.add_argument("-w", "--workers", type=int, metavar="N",
+            help=argparse["_parser_tune_workers"])
+    parser_list.set_defaults(function_name=tune)
+    # Create the parser for the "deploy" subcommand
+    parser_list = subparsers.add_parser("deploy",
+            description=argparse["_parser_deploy"],
+            help=argparse["_parser_deploy"])
+    parser_list.add_argument("--bundle", metavar="FILE",
+            help=argparse["_parser_deploy_bundle"])
+    parser_list.add_argument("--bwlimit", type=int, metavar="KIBPS",
+            help=argparse["_parser_deploy_bwlimit"])
+    parser_list.add_argument("--hosts", metavar="FILE", required=True,
+            help=argparse["_parser_deploy_hosts"])
+    parser_list.add_argument("--install", action="store_true",
+            help=argparse["_parser_deploy_install"])
+    parser_list.add_argument("-j", "--jobs", type=int, default=4,
+            help=argparse["_parser_deploy_jobs"])
+    parser_list.add_argument("--min-healthy", type=int, metavar="N",
+            help=argparse["_parser_deploy_min_healthy"])
+    parser_list.add_argument("-p", "--port", type=int,
+            help=argparse["_parser_start_port"])
+    parser_list.add_argument("--ready-timeout", type=float, default=300,
+            metavar="SECONDS", help=argparse["_parser_deploy_ready_timeout"])
+    parser_list.add_argument("--restart", action="store_true",
+            help=argparse["_parser_deploy_restart"])
+    parser_list.add_argument("--restart-command", metavar="COMMAND",
+            help=argparse["_parser_deploy_restart_command"])
+    parser_list.add_argument("--transport", default="ssh",
+            choices=["dry-run", "local", "ssh"],
+            help=argparse["_parser_deploy_transport"])
+    parser_list.set_defaults(function_name=deploy)
+    # Create the parser for the "links" subcommand
+    parser_list = subparsers.add_parser("links",
+            description=argparse["_parser_links"],
+            help=argparse["_parser_links"])
+    links_subparsers = parser_list.add_subparsers(dest="links_action")
+    links_export = links_subparsers.add_parser("export",
+            description=argparse["_parser_links_export"],
+            help=argparse["_parser_links_export"])
+    links_export.add_argument("-o", "--output", metavar="FILE", default='-',
+            help=argparse["_parser_links_output"])
+    links_export.add_argument("--since", metavar="WATERMARK",
+            help=argparse["_parser_links_since"])
+    links_export.add_argument("--state", metavar="FILE",
+            help=argparse["_parser_links_state"])
+    links_import = links_subparsers.add_parser("import",
+            description=argparse["_parser_links_import"],
+            help=argparse["_parser_links_import"])
+    links_import.add_argument("-i", "--input", metavar="FILE", default='-',
+            help=argparse["_parser_links_input"])
+    links_import.add_argument("--keep-existing", action="store_true",
+            help=argparse["_parser_links_keep_existing"])
+    links_merge = links_subparsers.add_parser("merge",
+            description=argparse["_parser_links_merge"],
+            help=argparse["_parser_links_merge"])
+    links_merge.add_argument("source", metavar="SOURCE_DB",
+            help=argparse["_parser_links_source"])
+    for links_parser in (links_export, links_import, links_merge):
+        links_parser.add_argument("--db", metavar="PATH",
+                help=argparse["_parser_links_db"])
+    parser_list.set_defaults(function_name=links)
     # Create the parser for the "open" subcommand
     parser_list = subparsers.add_parser("open",
             description=argparse["_parser_open"],
             help=argparse["_parser_open"])
     parser_list.set_defaults(function_name=open_sagemathcell)
+    # Create the parser for the "pack" subcommand
+    parser_list = subparsers.add_parser("pack",
+            description=argparse["_parser_pack"],
+            help=argparse["_parser_pack"])
+    parser_list.add_argument("-o", "--output", metavar="FILE",
+            help=argparse["_parser_pack_output"])
+    parser_list.set_defaults(function_name=pack)
+    # Create the parser for the "prefetch" subcommand
+    parser_list = subparsers.add_parser("prefetch",
+            description=argparse["_parser_prefetch"],
+            help=argparse["_parser_prefetch"])
+    parser_list.add_argument("--downloads-only", action="store_true",
+            help=argparse["_parser_prefetch_downloads_only"])
+    parser_list.add_argument("-j", "--jobs", type=int, default=4,
+            help=argparse["_parser_prefetch_jobs"])
+    parser_list.set_defaults(function_name=prefetch)
+    # Create the parser for the "profiles" subcommand
+    parser_list = subparsers.add_parser("profiles",
+            description=argparse["_parser_profiles"],
+            help=argparse["_parser_profiles"])
+    parser_list.add_argument("--benchmark", action="store_true",
+            help=argparse["_parser_profiles_benchmark"])
+    parser_list.set_defaults(function_name=profiles)
+    # Create the parser for the "prune" subcommand
+    parser_list = subparsers.add_parser("prune",
+            description=argparse["_parser_prune"],
+            help=argparse["_parser_prune"])
+    parser_list.add_argument("--dry-run", action="store_true",
+            help=argparse["_parser_prune_dry_run"])
+    parser_list.add_argument("--no-verify", action="store_true",
+            help=argparse["_parser_prune_no_verify"])
+    parser_list.set_defaults(function_name=prune)
     # Create the parser for the "ssh" subcommand
     parser_list = subparsers.add_parser("ssh",
             description=argparse["_parser_ssh"],
             help=argparse["_parser_ssh"])
+    parser_list.add_argument("--hosts", metavar="FILE",
+            help=argparse["_parser_ssh_hosts"])
     parser_list.set_defaults(function_name=ssh)
     # Create the parser for the "auto" subcommand
     parser_list = subparsers.add_parser("auto",
             description=argparse["_parser_auto"],
             help=argparse["_parser_auto"])
+    add_supervise_arguments(parser_list)
     parser_list.set_defaults(function_name=auto)
     if len(argv) == 1:
         parser.print_help()
         exit(0) # Clean exit without any errors/problems
     return parser.parse_args()
 
-def open_sagemathcell():
+def open_sagemathcell(args):
     """Open browser with the SageMathCell"""
 
-    local("xdg-open http://localhost:8888")
+    call(["xdg-open", "http://localhost:8888"])
 
-def ssh():
+def ssh(args):
     """Setup SSH for auto login to localhost without a password"""
 
-    # Update the Package Index
-    try:
-        # Ubuntu linux distro
-        local("sudo apt-get update")
-    except:
-        # Debian linux distro
-        local("su -c \"apt-get update\"")
     # Install openssh-server
-    try:
-        # Ubuntu linux distro
-        local("echo \"Y\" | sudo apt-get install openssh-server")
-    except:
-        # Debian linux distro
-        local("su -c \"echo \"Y\" | apt-get install openssh-server\"")
+    for command in create_package_plan(None, "ssh").commands():
+        try:
+            # Ubuntu linux distro
+            local(as_root("ubuntu", command))
+        except:
+            # Debian linux distro
+            local(as_root("debian", command))
     # Create a public and a private keys using the ssh-keygen command
-    local("ssh-keygen -t rsa -b 4096 -N '' -f ~/.ssh/id_rsa")
+    local("test -f ~/.ssh/id_rsa || "
+          "ssh-keygen -t rsa -b 4096 -N '' -f ~/.ssh/id_rsa")
     # Copy a public key using the ssh-copy-id command
     local("ssh-copy-id localhost")
+    if args.hosts is not None:
+        # Hosts of "sagecell deploy"
+        from .deploy import read_hosts
+        for host in read_hosts(args.hosts):
+            local("ssh-copy-id %s" % host)
     # Ensure ssh-agent is enabled and adds private key identities
     # to the authentication agent
     local("eval \"$(ssh-agent -s)\"; ssh-add ~/.ssh/id_rsa")
 
-def start():
+def sagecell_executable():
+    """Return an absolute path of the sagecell command"""
+
+    path = abspath(argv[0])
+    if basename(path) == "sagecell" and isfile(path):
+        return path
+    return "/usr/local/bin/sagecell"
+
+def start(args):
     """Start the SageMathCell"""
 
+    from .balancer import Backend, Balancer
+
     sagecell_path = expanduser("~/sc_build/sagecell")
+    if args.warm:
+        warm_up(dirname(sagecell_path), prefetch=True)
 
-    local("cd %s; ../sage/sage web_server.py" % sagecell_path)
+    if args.workers <= 1:
+        if args.port is None:
+            local("cd %s; ../sage/sage web_server.py" % sagecell_path)
+        else:
+            local("cd %s; ../sage/sage web_server.py -p %s" %
+                  (sagecell_path, args.port))
+        return
+    # Start workers on consecutive ports behind the balancer
+    worker_base_port = int(get_config()["worker_base_port"])
+    processes = []
+    backends = []
+    for index in range(args.workers):
+        worker_port = worker_base_port + index
+        # Own process group for stopping the sage script with children
+        processes.append(Popen("../sage/sage web_server.py -p %s" %
+                               worker_port, shell=True, cwd=sagecell_path,
+                               preexec_fn=setsid))
+        backends.append(Backend(index, "127.0.0.1", worker_port))
+    port = args.port or 8888
+    print(messages["_balancer"] % (args.workers, port))
+    balancer = Balancer(backends,
+            affinity_ttl=float(get_config()["balancer_affinity_ttl"]))
+    # Stop workers on "kill" too
+    signal(SIGTERM, lambda signum, frame: exit(0))
+    try:
+        balancer.serve("", port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            try:
+                killpg(process.pid, SIGTERM)
+            except OSError: # Already stopped
+                pass
+
+def supervise(args):
+    """Keep the SageMathCell running: restart on crash, check readiness"""
+
+    from .supervisor import apply_cgroup, supervise as supervise_loop
+
+    port = args.port or 8888
+    if args.memory_max or args.cpu_weight:
+        # Kernels (started by ssh) stay out of the web server cgroup
+        if not apply_cgroup("sagecell-web", args.memory_max,
+                            args.cpu_weight):
+            print(messages["_error_cgroup"])
+    command = [sagecell_executable(), "start", "--port", str(port),
+               "--workers", str(args.workers)]
+
+    def report(event, details):
+        print(messages["_supervise_%s" % event] % details)
+
+    # Stop the SageMathCell on "kill" too
+    signal(SIGTERM, lambda signum, frame: exit(0))
+    try:
+        supervise_loop(command, "http://localhost:%s/" % port, args.cpus,
+                       report=report)
+    except KeyboardInterrupt:
+        pass
+
+def supervise_command(args):
+    """Return the "sagecell supervise" command with options of args"""
+
+    command = [sagecell_executable(), "supervise", "--workers",
+               str(args.workers)]
+    if args.port is not None:
+        command += ["--port", str(args.port)]
+    # The systemd unit applies CPU and memory limits itself
+    if not isdir("/run/systemd/system"):
+        if args.cpus:
+            command += ["--cpus", args.cpus]
+        if args.memory_max:
+            command += ["--memory-max", args.memory_max]
+        if args.cpu_weight:
+            command += ["--cpu-weight", str(args.cpu_weight)]
+    return command
+
+def tune(args):
+    """Tune the SageMathCell configuration for the host"""
+
+    from .build import total_memory, usable_cpus
+    from .tune import config_diff, running_workers, tuned_config, tuning
+
+    sagecell_path = expanduser("~/sc_build/sagecell")
+    config_path = join(sagecell_path, "config.py")
+    config_default_path = join(sagecell_path, "config_default.py")
+
+    if exists(config_path):
+        with open(config_path, 'r') as f:
+            old_text = f.read()
+    elif exists(config_default_path):
+        with open(config_default_path, 'r') as f:
+            old_text = f.read()
+    else:
+        print(messages["_error_NoSageMathCell"])
+        exit(1)
+    # Size kernel pools for CPUs, RAM and workers sharing them
+    cpus = usable_cpus()
+    memory = total_memory()
+    workers = args.workers or running_workers() or 1
+    memory_per_kernel = int(get_config()["kernel_memory"]) * 1024 ** 2
+    settings = tuning(cpus, memory, workers, memory_per_kernel)
+    if memory is None:
+        print(messages["_error_NoMemory"])
+        comment = messages["_tune_comment_cpus"] % (cpus, workers)
+    else:
+        comment = messages["_tune_comment"] % (cpus, memory / 1024.0 ** 3,
+                                               workers)
+    new_text = tuned_config(old_text, settings, comment)
+    diff = config_diff(old_text, new_text, config_path)
+    if not diff:
+        print(messages["_tune_unchanged"])
+        return
+    print(diff)
+    if not args.dry_run:
+        with open(config_path, 'w') as f:
+            f.write(new_text)
+        print(messages["_tune_written"] % config_path)
+
+def warm_up(sc_build_path, prefetch):
+    """Byte-compile Python trees and prefetch them into the page cache"""
+
+    from .build import available_memory, usable_cpus
+    from .warm import warm
+
+    sage_path = join(sc_build_path, "sage")
+    lib_path = join(sage_path, "local/lib")
+    compile_paths = [path for path in
+                     (join(lib_path, "python2.7/site-packages"),
+                      join(sc_build_path, "ipython"),
+                      join(sc_build_path, "sagecell")) if isdir(path)]
+    max_bytes = 0
+    if prefetch:
+        max_bytes = int(get_config()["warm_prefetch_max"]) * 1048576
+        # Leave at least a half of available memory to kernels
+        memory = available_memory()
+        if memory is not None:
+            max_bytes = min(max_bytes, memory // 2)
+    report = warm([join(sage_path, "sage"), "-python"], compile_paths,
+                  [lib_path] + compile_paths[1:], max_bytes, usable_cpus())
+    print(messages["_warm_compiled"] % (report["stale"],
+                                        report["compile_time"]))
+    if report["compile_failures"]:
+        print(messages["_error_warm_compile"])
+    if max_bytes:
+        print(messages["_warm_prefetched"] %
+              (report["files"], report["bytes"] / 1048576.0,
+               report["prefetch_time"]))
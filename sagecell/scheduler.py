@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""Run installation steps as a dependency graph"""
+
+from threading import Condition, Thread
+from time import time
+
+class Step(object):
+    """Named installation step
+
+    "commands" is a list of shell commands or a callable which takes the
+    command runner. "requires" lists names of the steps which must be
+    completed first. Steps which share a name in "locks" never run at
+    the same time (e.g. two apt-get calls waiting on the dpkg lock).
+    "inputs" is a dict (or a callable returning a dict) of everything the
+    step result depends on, e.g. a commit SHA. A step without inputs is
+    never skipped by the journal. "metrics" filled by the commands are
+    recorded in the journal, e.g. the chosen build parallelism.
+    """
+
+    def __init__(self, name, commands, requires=(), locks=(), inputs=None):
+        self.name = name
+        self.commands = commands
+        self.requires = tuple(requires)
+        self.locks = tuple(locks)
+        self.inputs = inputs
+        self.metrics = {}
+
+    def __repr__(self):
+        return "Step(%r)" % self.name
+
+    def get_inputs(self):
+        """Return the step inputs"""
+
+        if callable(self.inputs):
+            return self.inputs()
+        return self.inputs
+
+    def run(self, runner):
+        """Run the step commands"""
+
+        if callable(self.commands):
+            self.commands(runner)
+        else:
+            for command in self.commands:
+                runner(command)
+
+class StepError(Exception):
+    """Installation step failed"""
+
+    def __init__(self, step, exception):
+        Exception.__init__(self, step.name)
+        self.step = step
+        self.exception = exception
+
+def check_steps(steps):
+    """Check for duplicate, unknown and cyclic dependencies"""
+
+    names = {}
+    for step in steps:
+        if step.name in names:
+            raise ValueError("duplicate step '%s'" % step.name)
+        names[step.name] = step
+    for step in steps:
+        for name in step.requires:
+            if name not in names:
+                raise ValueError("step '%s' requires unknown step '%s'" %
+                                 (step.name, name))
+    # Kahn's algorithm: anything left over is a part of a cycle
+    waiting = dict((step.name, len(set(step.requires))) for step in steps)
+    ready = [name for name, count in waiting.items() if count == 0]
+    resolved = 0
+    while ready:
+        name = ready.pop()
+        resolved += 1
+        for step in steps:
+            if name in step.requires:
+                waiting[step.name] -= 1
+                if waiting[step.name] == 0:
+                    ready.append(step.name)
+    if resolved != len(steps):
+        cycle = sorted(name for name, count in waiting.items() if count)
+        raise ValueError("dependency cycle between steps: %s" %
+                         ", ".join(cycle))
+
+def run_steps(steps, runner, jobs=1, journal=None, profiler=None):
+    """Run steps in dependency order, at most "jobs" steps at a time
+
+    "runner" executes a single shell command, e.g. fabric.api.local.
+    Steps are started in list order whenever their dependencies and locks
+    allow it. After the first failure no new steps are started; running
+    steps are allowed to finish and StepError is raised.
+
+    Steps recorded in the "journal" as completed with the same inputs are
+    skipped, the others are recorded after completion. Return names of
+    the skipped steps.
+
+    "profiler" is told by start(step) and finish(step, error) about every
+    run step, in the thread of the step.
+    """
+
+    check_steps(steps)
+    jobs = max(1, int(jobs))
+    condition = Condition()
+    pending = list(steps)
+    done = set()
+    held_locks = set()
+    failures = []
+    skipped = []
+
+    def next_step():
+        for step in pending:
+            if (all(name in done for name in step.requires) and
+                    not held_locks.intersection(step.locks)):
+                return step
+        return None
+
+    def worker():
+        while True:
+            with condition:
+                while True:
+                    if failures or not pending:
+                        return
+                    step = next_step()
+                    if step is not None:
+                        break
+                    condition.wait()
+                pending.remove(step)
+                held_locks.update(step.locks)
+            try:
+                inputs = step.get_inputs()
+                if (journal is not None and inputs is not None and
+                        journal.is_complete(step.name, inputs)):
+                    skipped.append(step.name)
+                else:
+                    start_time = time()
+                    if profiler is not None:
+                        profiler.start(step)
+                    try:
+                        step.run(runner)
+                    except BaseException as exception:
+                        if profiler is not None:
+                            profiler.finish(step, exception)
+                        raise
+                    if profiler is not None:
+                        profiler.finish(step)
+                    if journal is not None and inputs is not None:
+                        # Inputs may change by the step, e.g. a clone
+                        journal.record(step.name, step.get_inputs(),
+                                       time() - start_time, **step.metrics)
+            except BaseException as exception: # fabric aborts by SystemExit
+                with condition:
+                    failures.append(StepError(step, exception))
+                    held_locks.difference_update(step.locks)
+                    condition.notify_all()
+                return
+            with condition:
+                done.add(step.name)
+                held_locks.difference_update(step.locks)
+                condition.notify_all()
+
+    threads = [Thread(target=worker) for i in range(min(jobs, len(steps)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # Join with a timeout, so that Ctrl+C is not blocked in Python 2
+        while thread.is_alive():
+            thread.join(0.5)
+    if failures:
+        raise failures[0]
+    return skipped
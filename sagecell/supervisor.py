@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""Keep the SageMathCell running: restarts, readiness, CPU and memory"""
+
+from os import getpid, killpg, makedirs, setsid
+from os.path import exists, isdir, join
+from signal import SIGTERM
+from subprocess import Popen
+from time import sleep, time
+try:
+    from urllib2 import HTTPError, urlopen
+except ImportError: # Python 3
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+
+cgroup_root = "/sys/fs/cgroup"
+
+def is_ready(url, timeout=2):
+    """Check the server answers HTTP requests without a server error"""
+
+    try:
+        urlopen(url, timeout=timeout).close()
+    except HTTPError as error:
+        return error.code < 500
+    except Exception: # Connection refused, timeout, etc.
+        return False
+    return True
+
+def wait_ready(url, process, timeout, interval=0.5):
+    """Wait until the server is ready or the process exits"""
+
+    deadline = time() + timeout
+    while time() < deadline and process.poll() is None:
+        if is_ready(url):
+            return True
+        sleep(interval)
+    return False
+
+def apply_cgroup(name, memory_max=None, cpu_weight=None, pid=None):
+    """Move the process to a cgroup v2 with memory and CPU limits
+
+    Return False, if cgroup v2 is not available or not writable (root).
+    """
+
+    if not exists(join(cgroup_root, "cgroup.controllers")):
+        return False
+    path = join(cgroup_root, name)
+    try:
+        if not isdir(path):
+            makedirs(path)
+        if memory_max is not None:
+            with open(join(path, "memory.max"), 'w') as f:
+                f.write(str(memory_max))
+        if cpu_weight is not None:
+            with open(join(path, "cpu.weight"), 'w') as f:
+                f.write(str(cpu_weight))
+        with open(join(path, "cgroup.procs"), 'w') as f:
+            f.write(str(pid or getpid()))
+    except (IOError, OSError):
+        return False
+    return True
+
+def supervise(command, url, cpus=None, ready_timeout=300, backoff_min=1,
+              backoff_max=60, stable_time=60,
+              report=lambda event, details: None):
+    """Run the command forever, restart it with exponential backoff
+
+    The command is pinned to "cpus" (a taskset list, e.g. "0-1").
+    The backoff is reset after "stable_time" seconds of running. "report"
+    is called with ("up"|"not_ready"|"exit", details).
+    """
+
+    if cpus:
+        command = ["taskset", "-c", cpus] + list(command)
+    backoff = backoff_min
+    while True:
+        start_time = time()
+        # Own process group for stopping the command with children
+        process = Popen(command, preexec_fn=setsid)
+        try:
+            if wait_ready(url, process, ready_timeout):
+                report("up", time() - start_time)
+            elif process.poll() is None:
+                report("not_ready", ready_timeout)
+            process.wait()
+        except BaseException:
+            try:
+                killpg(process.pid, SIGTERM)
+            except OSError: # Already stopped
+                pass
+            raise
+        if time() - start_time >= stable_time:
+            backoff = backoff_min
+        report("exit", (process.returncode, backoff))
+        sleep(backoff)
+        backoff = min(backoff * 2, backoff_max)
+
+def systemd_unit(user, command, cpus=None, memory_max=None,
+                 cpu_weight=None):
+    """Return a systemd service unit for the command"""
+
+    lines = ["[Unit]",
+             "Description=SageMathCell",
+             "After=network.target",
+             "",
+             "[Service]",
+             "User=%s" % user,
+             "ExecStart=%s" % " ".join(command),
+             "Restart=always",
+             "RestartSec=2"]
+    if cpus:
+        lines.append("CPUAffinity=%s" % cpus.replace(',', ' '))
+    if memory_max:
+        lines.append("MemoryMax=%s" % memory_max)
+    if cpu_weight:
+        lines.append("CPUWeight=%s" % cpu_weight)
+    lines += ["", "[Install]", "WantedBy=multi-user.target", ""]
+    return "\n".join(lines)
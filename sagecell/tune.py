@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Size the SageMathCell kernel configuration for the host"""
+
+from difflib import unified_diff
+from math import ceil
+from os import listdir
+from os.path import basename
+
+begin_marker = "# BEGIN sagecell tune\n"
+end_marker = "# END sagecell tune\n"
+
+def running_workers():
+    """Return the number of running web_server.py processes"""
+
+    workers = 0
+    for pid in listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/%s/cmdline" % pid, 'r') as f:
+                args = f.read().split('\0')
+        except IOError: # Finished process
+            continue
+        # Count Python processes only, not the sage shell script
+        if (basename(args[0]).startswith("python") and
+                any(basename(arg) == "web_server.py" for arg in args)):
+            workers += 1
+    return workers
+
+def tuning(cpus, memory, workers, memory_per_kernel, kernels_per_cpu=2,
+           prefork_ratio=0.25):
+    """Return kernel settings for every worker
+
+    Kernels of all workers share the CPUs and 80% of memory, at least
+    "memory_per_kernel" bytes each. If "memory" is None (unknown), kernels
+    are limited by CPUs only. Every worker gets at least one kernel, the
+    workers never get more than their share otherwise. About
+    "prefork_ratio" of kernels are started in advance (a preforked pool),
+    so the first request does not wait for a cold kernel start. Kernels
+    get more CPU seconds, when memory allows fewer kernels than CPUs.
+    """
+
+    kernels = cpus * kernels_per_cpu
+    kernel_memory = None
+    if memory is not None:
+        kernel_memory = memory * 0.8
+        kernels = min(kernels, kernel_memory // memory_per_kernel)
+    kernels = max(1, int(kernels))
+    kernels_per_worker = max(1, kernels // workers)
+    # More providers start kernels in parallel, up to 8 kernels each
+    providers = max(1, min(cpus // workers, kernels_per_worker // 8))
+    max_kernels = kernels_per_worker // providers
+    rlimit_as = memory_per_kernel
+    if kernel_memory is not None:
+        rlimit_as = max(memory_per_kernel, kernel_memory // kernels)
+    return {"providers": providers,
+            "max_kernels": max_kernels,
+            "preforked_kernels": max(1, int(ceil(max_kernels *
+                                                 prefork_ratio))),
+            "rlimit_as": int(rlimit_as),
+            "rlimit_cpu": int(min(120, max(30, 30.0 * cpus *
+                                           kernels_per_cpu / kernels))),
+            # Idle kernels are kept longer, when there is room for them
+            "max_kernel_timeout": int(min(90, max(10, kernels)) * 60)}
+
+def tuned_config(text, settings, comment):
+    """Return config.py text with the replaced tuning block"""
+
+    if begin_marker in text and end_marker in text:
+        start = text.index(begin_marker)
+        end = text.index(end_marker) + len(end_marker)
+        text = text[:start] + text[end:]
+    if text and not text.endswith("\n"):
+        text += "\n"
+    block = [begin_marker,
+             "# %s\n" % comment.replace("%", "%%"),
+             "max_kernel_timeout = %(max_kernel_timeout)s\n",
+             "_computer = dict(computers[0]) if computers else {}\n",
+             "_computer.update({\"max_kernels\": %(max_kernels)s,\n",
+             "                  \"preforked_kernels\": "
+             "%(preforked_kernels)s})\n",
+             "_computer[\"resource_limits\"] = dict("
+             "_computer.get(\"resource_limits\", {}),\n",
+             "                                     "
+             "RLIMIT_AS=%(rlimit_as)s,\n",
+             "                                     "
+             "RLIMIT_CPU=%(rlimit_cpu)s)\n",
+             "computers = [dict(_computer) for _i in "
+             "range(%(providers)s)]\n",
+             end_marker]
+    return text + "".join(block) % settings
+
+def config_diff(old_text, new_text, path):
+    """Return a unified diff of the config"""
+
+    return "".join(unified_diff(old_text.splitlines(True),
+                                new_text.splitlines(True),
+                                path, path + " (tuned)"))
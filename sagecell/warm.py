@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""Byte-compile and prefetch Python trees before the first request"""
+
+from multiprocessing.pool import ThreadPool
+from os import listdir, lstat, stat, walk
+from os.path import isdir, join
+from subprocess import PIPE, Popen
+from time import time
+
+def source_files(paths):
+    """Yield .py files of the directories"""
+
+    for path in paths:
+        for dir_path, dir_names, file_names in walk(path):
+            for name in file_names:
+                if name.endswith(".py"):
+                    yield join(dir_path, name)
+
+def stale_modules(paths):
+    """Return the number of .py files without an up to date .pyc"""
+
+    stale = 0
+    for path in source_files(paths):
+        try:
+            source_time = stat(path).st_mtime
+        except OSError: # A dangling link
+            continue
+        try:
+            if stat(path + "c").st_mtime < source_time:
+                stale += 1
+        except OSError: # No .pyc
+            stale += 1
+    return stale
+
+def file_size(path):
+    """Return the size of the file (not of a link target) or 0"""
+
+    try:
+        return lstat(path).st_size
+    except OSError:
+        return 0
+
+def tree_size(path):
+    """Return the total size of files under the path"""
+
+    if not isdir(path):
+        return file_size(path)
+    return sum(file_size(join(dir_path, name))
+               for dir_path, dir_names, file_names in walk(path)
+               for name in file_names)
+
+def compile_trees(python, paths, jobs):
+    """Byte-compile the trees by "jobs" parallel compileall processes
+
+    Top-level entries of the trees are spread between processes by size.
+    Return the number of processes with errors (e.g. read-only files).
+    """
+
+    units = []
+    for path in paths:
+        if isdir(path):
+            units += [join(path, name) for name in listdir(path)
+                      if isdir(join(path, name)) or name.endswith(".py")]
+    sizes = sorted(((tree_size(unit), unit) for unit in units),
+                   reverse=True)
+    groups = [[] for i in range(max(1, min(jobs, len(units))))]
+    loads = [0] * len(groups)
+    for size, unit in sizes:
+        # The least loaded process gets the next largest unit
+        index = loads.index(min(loads))
+        groups[index].append(unit)
+        loads[index] += size
+    processes = [Popen(python + ["-m", "compileall", "-q"] + group,
+                       stdout=PIPE)
+                 for group in groups if group]
+    failures = 0
+    for process in processes:
+        process.communicate()
+        if process.returncode:
+            failures += 1
+    return failures
+
+def prefetch_candidates(paths):
+    """Return shared libraries and .pyc files, libraries first"""
+
+    libraries = []
+    modules = []
+    for path in paths:
+        for dir_path, dir_names, file_names in walk(path):
+            for name in file_names:
+                if name.endswith(".so") or ".so." in name:
+                    libraries.append(join(dir_path, name))
+                elif name.endswith(".pyc"):
+                    modules.append(join(dir_path, name))
+    return libraries + modules
+
+def read_file(path):
+    """Read the file into the page cache, return the number of bytes"""
+
+    size = 0
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                size += len(chunk)
+    except IOError:
+        pass
+    return size
+
+def prefetch(paths, max_bytes, jobs=4):
+    """Read shared libraries and modules into the page cache
+
+    At most "max_bytes" are read. Links are followed, but every file is
+    read (and counted) once, dangling links are skipped. Return the
+    number of files, bytes and seconds, the cold reads are no longer paid
+    by the first requests.
+    """
+
+    files = []
+    seen = set()
+    total = 0
+    for path in prefetch_candidates(paths):
+        try:
+            status = stat(path)
+        except OSError: # A dangling link
+            continue
+        if (status.st_dev, status.st_ino) in seen:
+            continue
+        seen.add((status.st_dev, status.st_ino))
+        if total + status.st_size > max_bytes:
+            continue
+        files.append(path)
+        total += status.st_size
+    start_time = time()
+    pool = ThreadPool(jobs)
+    try:
+        read = sum(pool.map(read_file, files, chunksize=16))
+    finally:
+        pool.close()
+    return len(files), read, time() - start_time
+
+def warm(python, compile_paths, prefetch_paths, max_bytes, jobs):
+    """Compile stale modules and prefetch files, return a report dict"""
+
+    report = {"stale": stale_modules(compile_paths)}
+    start_time = time()
+    report["compile_failures"] = 0
+    if report["stale"]:
+        report["compile_failures"] = compile_trees(python, compile_paths,
+                                                   jobs)
+    report["compile_time"] = time() - start_time
+    if max_bytes:
+        (report["files"], report["bytes"],
+         report["prefetch_time"]) = prefetch(prefetch_paths, max_bytes, jobs)
+    return report
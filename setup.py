@@ -2,10 +2,32 @@
 
 from os.path import dirname, join
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+class build_py_catalog(build_py):
+    """Build the package with a precompiled strings catalog"""
+
+    def run(self):
+        build_py.run(self)
+        catalog = {}
+        for name in ("argparse", "messages"):
+            path = join(dirname(__file__), "sagecell/config/%s.txt" % name)
+            with open(path, 'r') as f:
+                lines = f.read().splitlines()
+            catalog[name] = dict(zip(lines[0::2], lines[1::2]))
+        # Byte-compiled with the package by install_lib
+        catalog_path = join(self.build_lib, "sagecell/catalog.py")
+        if not self.dry_run:
+            with open(catalog_path, 'w') as f:
+                f.write("# -*- coding: utf-8 -*-\n\n"
+                        "# Generated by setup.py from config/*.txt\n\n")
+                f.write("catalog_argparse = %r\n" % catalog["argparse"])
+                f.write("catalog_messages = %r\n" % catalog["messages"])
 
 setup(
     author = "Ruslan Korniichuk",
     author_email = "ruslan.korniichuk@gmail.com",
+    cmdclass = {"build_py": build_py_catalog},
     classifiers = [
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
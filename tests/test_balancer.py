@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the load balancer with stand-in workers"""
+
+from socket import socket
+from threading import Thread
+from time import sleep, time
+from unittest import main, TestCase
+from uuid import uuid4
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import Request, urlopen
+except ImportError: # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import Request, urlopen
+
+from sagecell.balancer import Backend, Balancer
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """Worker which answers with its name and creates kernel ids"""
+
+    daemon_threads = True
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, text):
+        body = text.encode("ascii")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.answer("worker=%s" % self.server.name)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.answer("worker=%s id=%s" % (self.server.name, uuid4()))
+
+def free_port():
+    sock = socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class BalancerTest(TestCase):
+
+    def setUp(self):
+        self.servers = []
+        backends = []
+        for index in range(2):
+            server = StandInServer(("127.0.0.1", 0), StandInHandler)
+            server.name = str(index)
+            thread = Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self.servers.append(server)
+            backends.append(Backend(index, "127.0.0.1",
+                                    server.server_address[1]))
+        # No client address affinity: only cookies and kernel ids stick
+        self.balancer = Balancer(backends, affinity_ttl=0,
+                                 health_interval=0.1, health_failures=1)
+        self.port = free_port()
+        thread = Thread(target=self.balancer.serve,
+                        args=("127.0.0.1", self.port))
+        thread.daemon = True
+        thread.start()
+        deadline = time() + 5
+        while not self.balancer.running and time() < deadline:
+            sleep(0.05)
+        sleep(0.1)
+
+    def tearDown(self):
+        self.balancer.running = False
+        for server in self.servers:
+            if server.name is not None:
+                server.shutdown()
+                server.server_close()
+
+    def request(self, path, data=None, cookie=None):
+        request = Request("http://127.0.0.1:%s%s" % (self.port, path), data)
+        if cookie is not None:
+            request.add_header("Cookie", cookie)
+        response = urlopen(request, timeout=5)
+        try:
+            fields = dict(item.split("=") for item in
+                          response.read().decode("ascii").split())
+        finally:
+            response.close()
+        return fields
+
+    def stop(self, index):
+        server = self.servers[index]
+        server.shutdown()
+        server.server_close()
+        server.name = None
+
+    def test_new_sessions_spread(self):
+        workers = set(self.request("/")["worker"] for i in range(6))
+        self.assertEqual(workers, set(["0", "1"]))
+
+    def test_cookie_sticks(self):
+        for index in ("0", "1"):
+            for i in range(5):
+                fields = self.request("/", cookie="sagecell_worker=%s" %
+                                      index)
+                self.assertEqual(fields["worker"], index)
+
+    def test_kernel_id_sticks(self):
+        for i in range(2):
+            created = self.request("/kernel", b"accepted_tos=true")
+            for j in range(5):
+                fields = self.request("/kernel/%s/iopub" % created["id"])
+                self.assertEqual(fields["worker"], created["worker"])
+
+    def test_failed_backend_gets_no_traffic(self):
+        self.stop(0)
+        deadline = time() + 5
+        while self.balancer.backends[0].healthy and time() < deadline:
+            sleep(0.05)
+        self.assertFalse(self.balancer.backends[0].healthy)
+        for i in range(5):
+            self.assertEqual(self.request("/")["worker"], "1")
+        fields = self.request("/", cookie="sagecell_worker=0")
+        self.assertEqual(fields["worker"], "1")
+
+    def test_clients_expire(self):
+        head = b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        for port in range(5):
+            self.balancer.choose(head, ("10.0.0.1", port))
+            sleep(0.01)
+        # Only the last client is within the (zero) affinity time
+        self.assertEqual(list(self.balancer.clients), [("10.0.0.1", 4)])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the load generator with a stand-in SageMathCell server"""
+
+from json import dumps
+from threading import Lock, Thread
+from unittest import main, TestCase
+from uuid import uuid4
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+except ImportError: # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+
+from sagecell.bench import percentile, run_benchmark
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """/kernel and /service endpoints, which record requests"""
+
+    daemon_threads = True
+
+    def __init__(self, *args):
+        HTTPServer.__init__(self, *args)
+        self.lock = Lock()
+        self.kernels = set()
+        self.released = set()
+        self.codes = []
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, value, status=200):
+        body = dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("ascii"))
+        server = self.server
+        if self.path == "/kernel":
+            kernel_id = str(uuid4())
+            with server.lock:
+                server.kernels.add(kernel_id)
+            self.answer({"id": kernel_id, "ws_url": "ws://localhost/"})
+        elif self.path == "/service":
+            code = form["code"][0]
+            with server.lock:
+                server.codes.append(code)
+            if code == "1/0":
+                self.answer({"success": False, "error": "ZeroDivisionError"})
+            else:
+                self.answer({"success": True, "stdout": "2\n"})
+        else:
+            self.answer({}, 404)
+
+    def do_DELETE(self):
+        kernel_id = self.path.rpartition("/")[2]
+        with self.server.lock:
+            if kernel_id in self.server.kernels:
+                self.server.released.add(kernel_id)
+        self.answer({})
+
+class RunBenchmarkTest(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%s/" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_counts_and_latency(self):
+        results = run_benchmark(self.url, ["1+1", "1+1", "1/0"], 30, 4,
+                                timeout=10)
+        self.assertEqual(len(self.server.codes), 30)
+        self.assertEqual(self.server.codes.count("1/0"), 10)
+        self.assertEqual(results["errors"], 10)
+        self.assertAlmostEqual(results["error_rate"], 10.0 / (30 + 4))
+        latency = results["latency"]
+        self.assertEqual(latency["count"], 20)
+        self.assertTrue(latency["p50"] <= latency["p95"] <= latency["p99"] <=
+                        latency["max"])
+        self.assertEqual(results["kernel_acquire"]["count"], 4)
+
+    def test_kernels_released(self):
+        results = run_benchmark(self.url, ["1+1"], 8, 3, timeout=10)
+        self.assertEqual(results["errors"], 0)
+        self.assertEqual(len(self.server.kernels), 3)
+        self.assertEqual(self.server.released, self.server.kernels)
+        self.assertEqual(results["kernel_release_errors"], 0)
+
+    def test_without_kernel_probes(self):
+        results = run_benchmark(self.url, ["1+1"], 5, 2, timeout=10,
+                                kernel_probes=False)
+        self.assertEqual(len(self.server.kernels), 0)
+        self.assertEqual(results["latency"]["count"], 5)
+        self.assertEqual(results["error_rate"], 0.0)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([3], 0.95), 3)
+        self.assertEqual(percentile([], 0.5), None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the multi-host rollout with a fake transport"""
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from time import sleep
+from unittest import main, TestCase
+
+from sagecell.deploy import deploy, format_summary, Transport
+
+class FakeTransport(Transport):
+    """Transport which records calls and fails on chosen hosts"""
+
+    def __init__(self, host, log, recorder):
+        Transport.__init__(self, host, log)
+        self.recorder = recorder
+
+    def run(self, command):
+        self.recorder.call(self.host, "run", command)
+
+    def copy(self, path, remote_path, bwlimit=None):
+        self.recorder.call(self.host, "copy", bwlimit)
+
+    def check_ready(self, url, timeout):
+        self.recorder.call(self.host, "ready", url)
+
+class Recorder(object):
+    """Shared state of fake transports"""
+
+    def __init__(self, duration=0.05, fail=()):
+        self.duration = duration
+        self.fail = fail
+        self.lock = Lock()
+        self.active = 0
+        self.peak = 0
+        self.calls = []
+
+    def factory(self, host, log):
+        return FakeTransport(host, log, self)
+
+    def call(self, host, action, argument):
+        with self.lock:
+            self.calls.append((host, action, argument))
+            if action == "run":
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+        sleep(self.duration)
+        if action == "run":
+            with self.lock:
+                self.active -= 1
+        if host in self.fail:
+            raise RuntimeError("%s is down" % host)
+
+    def hosts(self):
+        return set(host for host, action, argument in self.calls)
+
+class DeployTest(TestCase):
+
+    hosts = ["h1", "h2", "h3", "h4"]
+
+    def setUp(self):
+        self.log_path = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.log_path)
+
+    def test_jobs_limit(self):
+        recorder = Recorder()
+        results = deploy(self.hosts, recorder.factory, self.log_path,
+                         install=True, jobs=2)
+        self.assertEqual(recorder.hosts(), set(self.hosts))
+        self.assertEqual(recorder.peak, 2)
+        for host in self.hosts:
+            self.assertEqual(results[host]["status"], "ok")
+            self.assertIn("install", results[host])
+
+    def test_min_healthy(self):
+        recorder = Recorder()
+        results = deploy(self.hosts, recorder.factory, self.log_path,
+                         install=True, restart_command="restart", jobs=4,
+                         min_healthy=3)
+        # One host is down at a time, every host is checked
+        self.assertEqual(recorder.peak, 1)
+        ready = [host for host, action, argument in recorder.calls
+                 if action == "ready"]
+        self.assertEqual(sorted(ready), self.hosts)
+        self.assertIn(("h1", "ready", "http://h1:8888/"), recorder.calls)
+        for host in self.hosts:
+            self.assertEqual(results[host]["status"], "ok")
+
+    def test_min_healthy_too_high(self):
+        recorder = Recorder()
+        with self.assertRaises(ValueError):
+            deploy(self.hosts, recorder.factory, self.log_path,
+                   install=True, min_healthy=4)
+        self.assertEqual(recorder.calls, [])
+
+    def test_bwlimit_split(self):
+        for bwlimit, jobs, expected in ((1000, 4, 250), (1000, 8, 250),
+                                        (3, 4, 1)):
+            recorder = Recorder(duration=0)
+            deploy(self.hosts, recorder.factory, self.log_path,
+                   bundle_path="/tmp/sagecell.tar", jobs=jobs,
+                   bwlimit=bwlimit)
+            copies = [argument for host, action, argument in recorder.calls
+                      if action == "copy"]
+            self.assertEqual(copies, [expected] * len(self.hosts))
+
+    def test_no_hosts_after_failure(self):
+        recorder = Recorder(fail=["h2"])
+        results = deploy(self.hosts, recorder.factory, self.log_path,
+                         install=True, jobs=1)
+        self.assertEqual(recorder.hosts(), set(["h1", "h2"]))
+        self.assertEqual(results["h1"]["status"], "ok")
+        self.assertEqual(results["h2"]["status"], "failed")
+        self.assertEqual(results["h2"]["error"], "install: h2 is down")
+        for host in ("h3", "h4"):
+            self.assertEqual(results[host], {"status": "not started"})
+
+    def test_format_summary(self):
+        results = {"h1": {"status": "ok", "copy": 1.5, "install": 30.0},
+                   "user@h2": {"status": "failed", "copy": 2.0,
+                               "error": "install: h2 is down"},
+                   "h3": {"status": "not started"}}
+        lines = format_summary(["h1", "user@h2", "h3"], results).split("\n")
+        self.assertEqual(lines, [
+            "host    status           copy  install  restart    ready",
+            "h1      ok               1.5s    30.0s        -        -",
+            "user@h2 failed           2.0s        -        -        -"
+            "  install: h2 is down",
+            "h3      not started         -        -        -        -"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the git mirror cache with throwaway repositories"""
+
+from os import environ
+from os.path import isdir, join
+from shutil import rmtree
+from subprocess import check_call, check_output
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from sagecell.gitcache import (checkout, mirror_head, mirror_path,
+                               update_mirror)
+
+url = "https://example.invalid/sagecell.git"
+
+def git(path, *args):
+    environment = dict(environ, GIT_AUTHOR_NAME="test",
+                       GIT_AUTHOR_EMAIL="test@example.com",
+                       GIT_COMMITTER_NAME="test",
+                       GIT_COMMITTER_EMAIL="test@example.com")
+    return check_output(["git", "-C", path] + list(args),
+                        env=environment).decode("ascii").strip()
+
+def run(command):
+    check_call(command, shell=True)
+
+class GitCacheTest(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.source = join(self.path, "source")
+        check_call(["git", "init", "-q", self.source])
+        git(self.source, "checkout", "-q", "-b", "sagecell")
+        self.commit("first")
+        self.cache = join(self.path, "cache")
+        self.checkout_path = join(self.path, "checkout")
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def commit(self, message):
+        with open(join(self.source, "file"), 'w') as f:
+            f.write(message)
+        git(self.source, "add", "file")
+        git(self.source, "commit", "-q", "-m", message)
+        return git(self.source, "rev-parse", "HEAD")
+
+    def test_mirror_path(self):
+        self.assertEqual(mirror_path("/cache", url),
+                         "/cache/example.invalid/sagecell.git")
+        self.assertEqual(mirror_path("/cache",
+                                     "https://user@github.com/a/b/"),
+                         "/cache/github.com/a/b.git")
+
+    def test_mirror_from_source(self):
+        path = update_mirror(run, self.cache, url, self.source)
+        self.assertTrue(isdir(path))
+        # Later updates go to the URL, not the source
+        self.assertEqual(git(path, "config", "remote.origin.url"), url)
+        self.assertEqual(mirror_head(self.cache, url, "sagecell"),
+                         git(self.source, "rev-parse", "HEAD").encode())
+        self.assertIsNone(mirror_head(self.cache, url, "other"))
+
+    def test_checkout_and_update_in_place(self):
+        update_mirror(run, self.cache, url, self.source)
+        mirror = mirror_path(self.cache, url)
+        checkout(run, mirror, url, self.checkout_path, "sagecell")
+        self.assertEqual(git(self.checkout_path, "remote", "get-url",
+                             "origin"), url)
+        with open(join(self.checkout_path, "file"), 'r') as f:
+            self.assertEqual(f.read(), "first")
+        # A new commit reaches the checkout through the mirror
+        sha = self.commit("second")
+        update_mirror(run, self.cache, url, self.source)
+        self.assertEqual(mirror_head(self.cache, url, "sagecell"),
+                         sha.encode())
+        with open(join(self.checkout_path, "untracked"), 'w') as f:
+            f.write("kept")
+        checkout(run, mirror, url, self.checkout_path, "sagecell")
+        self.assertEqual(git(self.checkout_path, "rev-parse", "HEAD"), sha)
+        with open(join(self.checkout_path, "file"), 'r') as f:
+            self.assertEqual(f.read(), "second")
+        # Updated in place, not cloned again
+        with open(join(self.checkout_path, "untracked"), 'r') as f:
+            self.assertEqual(f.read(), "kept")
+
+if __name__ == "__main__":
+    main()
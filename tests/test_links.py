@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the permalink export and import"""
+
+from gzip import GzipFile
+from io import BytesIO
+from json import dumps, loads
+from sqlite3 import connect
+from unittest import main, TestCase
+
+from sagecell.links import (binary_type, export_rows, import_rows,
+                            read_lines, write_lines)
+
+class LinksTest(TestCase):
+
+    def setUp(self):
+        self.source = connect(":memory:")
+        self.source.execute("CREATE TABLE permalinks (ident TEXT PRIMARY "
+                            "KEY, code BLOB, created INTEGER)")
+        self.source.executemany("INSERT INTO permalinks VALUES (?, ?, ?)",
+                                [("a", binary_type(b"\x00\xff"), 1),
+                                 ("b", "text", 2), ("c", None, 3)])
+        self.target = connect(":memory:")
+
+    def test_blob_round_trip(self):
+        # Through JSON as in the export and import commands
+        items = [loads(dumps(item)) for item in
+                 export_rows(self.source, "permalinks", "created")]
+        counts = import_rows(self.target, items)
+        self.assertEqual(counts["rows"], 3)
+        self.assertEqual(counts["watermark"], 3)
+        rows = self.target.execute("SELECT ident, code FROM permalinks "
+                                   "ORDER BY ident").fetchall()
+        self.assertEqual(bytes(rows[0][1]), b"\x00\xff")
+        self.assertEqual(rows[1:], [("b", "text"), ("c", None)])
+
+    def test_gzip_file(self):
+        data = BytesIO()
+        with GzipFile(fileobj=data, mode='wb') as f:
+            write_lines(export_rows(self.source, "permalinks", "created"), f)
+        data.seek(0)
+        with GzipFile(fileobj=data, mode='rb') as f:
+            counts = import_rows(self.target, read_lines(f))
+        self.assertEqual(counts["rows"], 3)
+
+if __name__ == "__main__":
+    main()
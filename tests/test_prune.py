@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the disk footprint reduction"""
+
+from os import environ, link, makedirs
+from os.path import join
+from shutil import rmtree
+from subprocess import check_call, check_output
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+from sagecell.prune import compact_repository, disk_usage, shares_objects
+
+def git(path, *args):
+    environment = dict(environ, GIT_AUTHOR_NAME="test",
+                       GIT_AUTHOR_EMAIL="test@example.com",
+                       GIT_COMMITTER_NAME="test",
+                       GIT_COMMITTER_EMAIL="test@example.com")
+    check_output(["git", "-C", path] + list(args), env=environment)
+
+class DiskUsageTest(TestCase):
+
+    def setUp(self):
+        self.path = mkdtemp()
+        self.tree = join(self.path, "tree")
+        makedirs(self.tree)
+        self.file_path = join(self.tree, "data")
+        with open(self.file_path, 'wb') as f:
+            f.write(b"x" * 65536)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def test_links_in_tree_counted_once(self):
+        before = disk_usage(self.tree)
+        link(self.file_path, join(self.tree, "copy"))
+        self.assertEqual(disk_usage(self.tree), before)
+        self.assertGreaterEqual(before, 65536)
+
+    def test_links_outside_tree_not_counted(self):
+        before = disk_usage(self.tree)
+        link(self.file_path, join(self.path, "outside"))
+        self.assertLessEqual(disk_usage(self.tree), before - 65536)
+        self.assertEqual(disk_usage(self.file_path), 0)
+
+    def test_clone_shares_mirror(self):
+        source = join(self.path, "source")
+        check_call(["git", "init", "-q", source])
+        git(source, "commit", "-q", "--allow-empty", "-m", "first")
+        git(source, "gc", "-q")
+        clone = join(self.path, "clone")
+        check_call(["git", "clone", "-q", source, clone])
+        self.assertTrue(shares_objects(clone))
+        self.assertEqual(compact_repository(None, clone), 0)
+
+if __name__ == "__main__":
+    main()
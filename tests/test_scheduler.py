@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the installation steps scheduler"""
+
+from threading import Lock
+from time import sleep, time
+from unittest import main, TestCase
+
+from sagecell.scheduler import run_steps, Step, StepError
+
+class RecordingRunner(object):
+    """Fake command runner which records command intervals"""
+
+    def __init__(self, duration=0.05, fail=()):
+        self.duration = duration
+        self.fail = fail
+        self.lock = Lock()
+        self.active = 0
+        self.peak = 0
+        self.intervals = {}
+
+    def __call__(self, command):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        start_time = time()
+        sleep(self.duration)
+        with self.lock:
+            self.active -= 1
+            self.intervals[command] = (start_time, time())
+        if command in self.fail:
+            raise RuntimeError(command)
+
+    def overlap(self, first, second):
+        """Check the commands ran at the same time"""
+
+        first_start, first_end = self.intervals[first]
+        second_start, second_end = self.intervals[second]
+        return first_start < second_end and second_start < first_end
+
+class RunStepsTest(TestCase):
+
+    def test_dependencies_run_first(self):
+        runner = RecordingRunner()
+        steps = [Step("c", ["c"], requires=["a", "b"]),
+                 Step("a", ["a"]),
+                 Step("b", ["b"], requires=["a"]),
+                 Step("d", ["d"])]
+        run_steps(steps, runner, jobs=4)
+        self.assertEqual(set(runner.intervals), set("abcd"))
+        for step in steps:
+            for name in step.requires:
+                self.assertLessEqual(runner.intervals[name][1],
+                                     runner.intervals[step.name][0])
+
+    def test_concurrency_limit(self):
+        runner = RecordingRunner()
+        steps = [Step(str(i), [str(i)]) for i in range(8)]
+        run_steps(steps, runner, jobs=3)
+        self.assertEqual(len(runner.intervals), 8)
+        self.assertLessEqual(runner.peak, 3)
+        self.assertGreater(runner.peak, 1)
+
+    def test_locks(self):
+        runner = RecordingRunner()
+        steps = [Step("apt1", ["apt1"], locks=["dpkg"]),
+                 Step("apt2", ["apt2"], locks=["dpkg"]),
+                 Step("apt3", ["apt3"], locks=["dpkg", "other"]),
+                 Step("free", ["free"])]
+        run_steps(steps, runner, jobs=4)
+        for first, second in (("apt1", "apt2"), ("apt1", "apt3"),
+                              ("apt2", "apt3")):
+            self.assertFalse(runner.overlap(first, second))
+        self.assertTrue(runner.overlap("apt1", "free"))
+
+    def test_no_steps_after_failure(self):
+        runner = RecordingRunner(fail=["bad"])
+        steps = [Step("bad", ["bad"]),
+                 Step("slow", ["slow1", "slow2"]),
+                 Step("later", ["later"], requires=["slow"]),
+                 Step("dependent", ["dependent"], requires=["bad"])]
+        with self.assertRaises(StepError) as context:
+            run_steps(steps, runner, jobs=2)
+        self.assertEqual(context.exception.step.name, "bad")
+        # The running step finishes, nothing new starts
+        self.assertIn("slow2", runner.intervals)
+        self.assertNotIn("later", runner.intervals)
+        self.assertNotIn("dependent", runner.intervals)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the kernel configuration sizing"""
+
+from unittest import main, TestCase
+
+from sagecell.tune import tuning
+
+gib = 1024 ** 3
+
+class TuningTest(TestCase):
+
+    def total_kernels(self, settings, workers):
+        return settings["providers"] * settings["max_kernels"] * workers
+
+    def test_workers_share_kernels(self):
+        for cpus, memory, workers in ((8, 16 * gib, 2), (64, 512 * gib, 3),
+                                      (16, 64 * gib, 5)):
+            settings = tuning(cpus, memory, workers, gib)
+            kernels = min(cpus * 2, int(memory * 0.8 // gib))
+            self.assertLessEqual(self.total_kernels(settings, workers),
+                                 kernels)
+            self.assertGreaterEqual(settings["rlimit_as"], gib)
+
+    def test_unknown_memory(self):
+        settings = tuning(8, None, 2, gib)
+        self.assertEqual(self.total_kernels(settings, 2), 16)
+        self.assertEqual(settings["rlimit_as"], gib)
+
+    def test_kernel_per_worker(self):
+        settings = tuning(1, gib, 4, gib)
+        self.assertEqual(settings["providers"], 1)
+        self.assertEqual(settings["max_kernels"], 1)
+        self.assertEqual(settings["preforked_kernels"], 1)
+
+if __name__ == "__main__":
+    main()